@@ -0,0 +1,71 @@
+import argparse
+import json
+import pathlib
+import time
+
+from db.embedders import EMBEDDING_MODEL_NAME
+from extensions.documents_to_chunks import CONVERTER_PROFILES, Chunk
+
+
+def convert_all(chunk: Chunk, chunker, pdf_files: list[pathlib.Path], prepass: bool, workers: int) -> dict:
+    stats = {"prepass": prepass, "files": 0, "pages": 0, "ocr_pages": 0, "table_pages": 0, "chunks": 0}
+
+    started = time.perf_counter()
+    for file_path in pdf_files:
+        elements, ranges = chunk._file_to_documents(chunker, file_path, workers=workers, prepass=prepass)
+        stats["files"] += 1
+        stats["pages"] += sum(r.pages for r in ranges)
+        stats["ocr_pages"] += sum(r.pages for r in ranges if r.ocr)
+        stats["table_pages"] += sum(r.pages for r in ranges if r.tables)
+        stats["chunks"] += len(elements)
+    elapsed = time.perf_counter() - started
+
+    stats["seconds"] = elapsed
+    stats["pages_per_second"] = stats["pages"] / elapsed if elapsed else 0.0
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Скорость конвертации PDF с пре-проходом OCR и без него")
+    parser.add_argument("source_directory")
+    parser.add_argument("--limit", type=int, default=10, help="сколько PDF взять из каталога")
+    parser.add_argument("--workers", type=int, default=1, help="параллельных диапазонов страниц на файл")
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    pdf_files = sorted(pathlib.Path(args.source_directory).glob("*.pdf"))[:args.limit]
+    # Все профили держим загруженными, чтобы перезагрузка моделей при вытеснении не попала в замер
+    chunk = Chunk(args.source_directory, args.source_directory, EMBEDDING_MODEL_NAME,
+                  max_converters=len(CONVERTER_PROFILES))
+    chunker = chunk._get_chunker()
+
+    # Прогрев моделей layout/OCR/TableFormer каждого профиля - здесь или в каждом процессе пула
+    if pdf_files:
+        if args.workers > 1:
+            chunk.start_range_pool(args.workers, warm_up_file=pdf_files[0])
+        else:
+            chunk.warm_up(pdf_files[0])
+
+    try:
+        without_prepass = convert_all(chunk, chunker, pdf_files, prepass=False, workers=args.workers)
+        with_prepass = convert_all(chunk, chunker, pdf_files, prepass=True, workers=args.workers)
+    finally:
+        chunk.close()
+
+    report = {
+        "without_prepass": without_prepass,
+        "with_prepass": with_prepass,
+        "speedup": (with_prepass["pages_per_second"] / without_prepass["pages_per_second"]
+                    if without_prepass["pages_per_second"] else None),
+    }
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+
+from benchmarks.synthetic import VOCABULARY, synthetic_text
+
+
+LINES_PER_PAGE = 48
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(lines: list[str]) -> bytes:
+    """Минимальный PDF с текстовым слоем, который читает PyPDFLoader."""
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page_lines in pages:
+        body = "BT /F1 11 Tf 14 TL 50 790 Td " + " ".join(f"({_escape(line)}) '" for line in page_lines) + " ET"
+        content = body.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids)
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def synthetic_paper(index: int, pages: int = 3) -> bytes:
+    rng = random.Random(index)
+    lines = [f"Synthetic paper {index}: {synthetic_text(rng, words=6)}"]
+    for _ in range(pages * LINES_PER_PAGE - 1):
+        lines.append(synthetic_text(rng, words=12))
+    return make_pdf(lines)
+
+
+class FakeLLMStats:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.rate_limited = 0
+        self.streams = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counters) -> None:
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "rate_limited": self.rate_limited, "streams": self.streams}
+
+
+def create_llm_app(
+        latency: float = 0.5,
+        jitter: float = 0.2,
+        token_delay: float = 0.02,
+        tokens: int = 60,
+        rate_limit_probability: float = 0.0,
+        requests_per_minute: int = 0,
+        retry_after: float = 1.0
+) -> FastAPI:
+    """Заглушка /api/v1/chat/completions в формате OpenRouter."""
+    app = FastAPI(title="Fake OpenRouter")
+    stats = FakeLLMStats()
+    window: deque[float] = deque()
+    window_lock = threading.Lock()
+    app.state.stats = stats
+
+    def rate_limited() -> bool:
+        if rate_limit_probability and random.random() < rate_limit_probability:
+            return True
+        if not requests_per_minute:
+            return False
+        now = time.monotonic()
+        with window_lock:
+            while window and now - window[0] > 60:
+                window.popleft()
+            if len(window) >= requests_per_minute:
+                return True
+            window.append(now)
+        return False
+
+    def answer_tokens() -> list[str]:
+        return [random.choice(VOCABULARY) + " " for _ in range(tokens)]
+
+    @app.post("/api/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        stats.add(requests=1)
+        if rate_limited():
+            stats.add(rate_limited=1)
+            return JSONResponse(
+                {"error": {"code": 429, "message": "Rate limit exceeded (fake)"}},
+                status_code=429,
+                headers={"Retry-After": str(retry_after)}
+            )
+
+        await asyncio.sleep(max(0.0, random.gauss(latency, jitter)))
+        model = payload.get("model", "fake")
+
+        if not payload.get("stream"):
+            return {
+                "id": "fake",
+                "model": model,
+                "choices": [{"message": {"role": "assistant", "content": "".join(answer_tokens())}}],
+            }
+
+        stats.add(streams=1)
+
+        async def events():
+            for token in answer_tokens():
+                chunk = {"id": "fake", "model": model, "choices": [{"delta": {"content": token}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(token_delay)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats.to_dict()
+
+    return app
+
+
+def create_paper_app(pages: int = 3) -> FastAPI:
+    """Сайт издательства: страница статьи с citation_pdf_url и сам PDF."""
+    app = FastAPI(title="Fake paper site")
+
+    @app.get("/paper/{index}", response_class=HTMLResponse)
+    async def landing(index: int):
+        return (
+            "<html><head>"
+            f"<meta name=\"citation_title\" content=\"Synthetic paper {index}\">"
+            f"<meta name=\"citation_pdf_url\" content=\"/pdf/{index}.pdf\">"
+            f"</head><body><h1>Synthetic paper {index}</h1></body></html>"
+        )
+
+    @app.get("/pdf/{index}.pdf")
+    async def pdf(index: int):
+        return Response(synthetic_paper(index, pages), media_type="application/pdf")
+
+    return app
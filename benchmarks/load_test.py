@@ -0,0 +1,335 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+
+from benchmarks.fakes import create_llm_app, create_paper_app
+from benchmarks.synthetic import synthetic_text
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FINAL_STATES = ("SUCCESS", "FAILURE", "REVOKED")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve_in_thread(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def _wait_http(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} не поднялся за {timeout:.0f} с")
+
+
+def start_redis(port: int) -> tuple[str, object]:
+    """Локальный redis-server, а если его нет - fakeredis в этом процессе."""
+    binary = shutil.which("redis-server")
+    if binary:
+        process = subprocess.Popen(
+            [binary, "--port", str(port), "--save", "", "--appendonly", "no"],
+            stdout=subprocess.DEVNULL
+        )
+        url = f"redis://127.0.0.1:{port}/0"
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                return url, process
+            except OSError:
+                time.sleep(0.1)
+        process.terminate()
+        raise RuntimeError("redis-server не запустился")
+
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        raise RuntimeError("Нужен redis-server в PATH, fakeredis>=2.23 или --redis-url")
+    print("redis-server не найден, использую fakeredis")
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0", server
+
+
+class StageStats:
+    def __init__(self) -> None:
+        self.samples: dict[str, list[tuple[float, bool]]] = {}
+        self.windows: dict[str, list[float]] = {}
+        self.chunks_written = 0
+
+    def record(self, stage: str, seconds: float, ok: bool) -> None:
+        self.samples.setdefault(stage, []).append((seconds, ok))
+
+    def window(self, stage: str, started: float, finished: float) -> None:
+        self.windows[stage.split(".")[0]] = [started, finished]
+
+    @staticmethod
+    def _percentile(values: list[float], q: float) -> float | None:
+        if not values:
+            return None
+        values = sorted(values)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def report(self) -> dict:
+        report = {}
+        for stage, samples in sorted(self.samples.items()):
+            ok = [seconds for seconds, success in samples if success]
+            started, finished = self.windows.get(stage.split(".")[0], (0.0, 0.0))
+            wall = max(finished - started, 1e-9)
+            report[stage] = {
+                "count": len(samples),
+                "ok": len(ok),
+                "errors": len(samples) - len(ok),
+                "error_rate": (len(samples) - len(ok)) / len(samples),
+                "throughput_per_s": len(ok) / wall,
+                "p50": self._percentile(ok, 0.50),
+                "p90": self._percentile(ok, 0.90),
+                "p95": self._percentile(ok, 0.95),
+                "p99": self._percentile(ok, 0.99),
+                "max": max(ok) if ok else None,
+            }
+        return report
+
+
+async def _run_scenario(name: str, total: int, concurrency: int, job, stats: StageStats) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(i: int) -> None:
+        async with semaphore:
+            try:
+                await job(i)
+            except Exception as e:
+                stats.record(f"{name}.exception", 0.0, False)
+                print(f"[{name} #{i}] {type(e).__name__}: {e}")
+
+    started = time.monotonic()
+    await asyncio.gather(*(run(i) for i in range(total)))
+    stats.window(name, started, time.monotonic())
+
+
+async def drive_articles(
+        client: httpx.AsyncClient,
+        paper_url: str,
+        total: int,
+        concurrency: int,
+        timeout: float,
+        stats: StageStats
+) -> None:
+    offset = random.randrange(1_000_000)
+
+    async def job(i: int) -> None:
+        started = time.monotonic()
+        response = await client.post("/api/v1/article/", json={"url": f"{paper_url}/paper/{offset + i}"})
+        stats.record("article.enqueue", time.monotonic() - started, response.status_code == 202)
+        if response.status_code != 202:
+            return
+        job_id = response.json()["job_id"]
+
+        deadline = started + timeout
+        state = {}
+        while time.monotonic() < deadline:
+            state = (await client.get(f"/api/v1/article/{job_id}")).json()
+            if state.get("status") in FINAL_STATES:
+                break
+            await asyncio.sleep(0.25)
+
+        # Задание со SKIPPED-стадиями тоже SUCCESS, поэтому успехом считаем только записанные чанки
+        upsert = state.get("stages", {}).get("upsert", {})
+        written = upsert.get("added", 0) + upsert.get("updated", 0) if upsert.get("status") == "SUCCESS" else 0
+        stats.chunks_written += written
+        stats.record("article.total", time.monotonic() - started, state.get("status") == "SUCCESS" and written > 0)
+        for stage, info in state.get("stages", {}).items():
+            if "duration" in info:
+                stats.record(f"article.{stage}", info["duration"], info["status"] == "SUCCESS")
+
+    await _run_scenario("article", total, concurrency, job, stats)
+
+
+async def drive_hypotheses(
+        client: httpx.AsyncClient,
+        total: int,
+        concurrency: int,
+        timeout: float,
+        stats: StageStats
+) -> None:
+    rng = random.Random()
+
+    async def job(i: int) -> None:
+        # Уникальные тексты, чтобы не мерить кэш ответов
+        text = f"Предложи гипотезу: {synthetic_text(rng, words=10)}"
+        started = time.monotonic()
+        response = await client.post("/api/v1/hypothesis/", json={"text": text})
+        stats.record("hypothesis.enqueue", time.monotonic() - started, response.status_code == 200)
+        if response.status_code != 200:
+            return
+        task_id = response.json()["task_id"]
+
+        deadline = started + timeout
+        ok = False
+        while time.monotonic() < deadline:
+            wait = min(30.0, max(1.0, deadline - time.monotonic()))
+            response = await client.get(f"/api/v1/hypothesis/{task_id}", params={"wait": wait})
+            if response.status_code != 200:
+                break
+            if response.json().get("status") in FINAL_STATES:
+                ok = response.json()["status"] == "SUCCESS"
+                break
+        stats.record("hypothesis.total", time.monotonic() - started, ok)
+
+    await _run_scenario("hypothesis", total, concurrency, job, stats)
+
+
+def start_stack(args, env: dict) -> list[subprocess.Popen]:
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "celery", "-A", "source.services.celery_app:celery_app", "worker",
+             "--loglevel", "warning", "--concurrency", str(args.worker_concurrency)],
+            cwd=ROOT, env=env
+        ),
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "source.main:app",
+             "--host", "127.0.0.1", "--port", str(args.api_port), "--log-level", "warning"],
+            cwd=ROOT, env=env
+        ),
+    ]
+    _wait_http(f"http://127.0.0.1:{args.api_port}/metrics", args.startup_timeout)
+    return processes
+
+
+async def drive(args, paper_url: str, stats: StageStats) -> None:
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=args.api_url, timeout=60, limits=limits) as client:
+        if "article" in args.scenarios:
+            print(f"Загрузка статей: {args.articles} запросов, параллельно {args.concurrency}")
+            await drive_articles(client, paper_url, args.articles, args.concurrency, args.timeout, stats)
+        if "hypothesis" in args.scenarios:
+            print(f"Генерация гипотез: {args.hypotheses} запросов, параллельно {args.concurrency}")
+            await drive_hypotheses(client, args.hypotheses, args.concurrency, args.timeout, stats)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест без OpenRouter и сайтов издательств")
+    parser.add_argument("--scenarios", default="article,hypothesis")
+    parser.add_argument("--articles", type=int, default=20)
+    parser.add_argument("--hypotheses", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=300, help="предел на один запрос, с")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--llm-token-delay", type=float, default=0.02)
+    parser.add_argument("--llm-429-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--llm-rpm", type=int, default=0, help="лимит заглушки, запросов в минуту")
+    parser.add_argument("--rate-rpm", type=int, default=0, help="LLM_RATE_RPM для воркеров, 0 - без лимитера")
+    parser.add_argument("--rate-tpm", type=int, default=0, help="LLM_RATE_TPM для воркеров")
+    parser.add_argument("--paper-pages", type=int, default=3)
+    parser.add_argument("--redis-url", help="использовать готовый Redis вместо локального")
+    parser.add_argument("--api-url", help="использовать уже запущенный API и воркеры")
+    parser.add_argument("--api-port", type=int, default=0)
+    parser.add_argument("--worker-concurrency", type=int, default=4)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+    args.scenarios = {s.strip() for s in args.scenarios.split(",")}
+
+    llm_app = create_llm_app(
+        latency=args.llm_latency,
+        jitter=args.llm_jitter,
+        token_delay=args.llm_token_delay,
+        rate_limit_probability=args.llm_429_rate,
+        requests_per_minute=args.llm_rpm
+    )
+    llm_port, paper_port = _free_port(), _free_port()
+    servers = [_serve_in_thread(llm_app, llm_port), _serve_in_thread(create_paper_app(args.paper_pages), paper_port)]
+    paper_url = f"http://127.0.0.1:{paper_port}"
+
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    redis_handle = None
+    processes: list[subprocess.Popen] = []
+    env = {
+        **os.environ,
+        "LLM_URL": f"http://127.0.0.1:{llm_port}/api/v1/chat/completions",
+        "API_KEY": "loadtest",
+        "DOWNLOAD_TIERS": "http",
+        "LLM_RATE_RPM": str(args.rate_rpm),
+        "LLM_RATE_TPM": str(args.rate_tpm),
+        "SEMANTIC_SCHOLAR_API": f"http://127.0.0.1:{llm_port}/semantic-scholar",
+        "DATA_SOURCES_DIR": os.path.join(workdir, "data_sources"),
+        "VECTOR_STORE_PATH": os.path.join(workdir, "vector_store"),
+    }
+
+    try:
+        if not args.api_url:
+            redis_url = args.redis_url
+            if not redis_url:
+                redis_url, redis_handle = start_redis(_free_port())
+            env["REDIS_URL"] = redis_url
+            args.api_port = args.api_port or _free_port()
+            args.api_url = f"http://127.0.0.1:{args.api_port}"
+            processes = start_stack(args, env)
+        else:
+            print("Стек запущен отдельно; для работы с заглушками ему нужны переменные:")
+            for key in ("LLM_URL", "API_KEY", "DOWNLOAD_TIERS", "SEMANTIC_SCHOLAR_API", "LLM_RATE_RPM", "LLM_RATE_TPM"):
+                print(f"  {key}={env[key]}")
+
+        stats = StageStats()
+        asyncio.run(drive(args, paper_url, stats))
+
+        report = {
+            "config": {key: value if not isinstance(value, set) else sorted(value) for key, value in vars(args).items()},
+            "stages": stats.report(),
+            "chunks_written": stats.chunks_written,
+            "fake_llm": llm_app.state.stats.to_dict(),
+        }
+        report["ok"] = "article" not in args.scenarios or not args.articles or stats.chunks_written > 0
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+        if isinstance(redis_handle, subprocess.Popen):
+            redis_handle.terminate()
+        elif redis_handle is not None:
+            redis_handle.shutdown()
+        for server in servers:
+            server.should_exit = True
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if not report["ok"]:
+        print("Ни одна статья не дошла до базы: ни одного записанного чанка")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import hashlib
+import json
+import math
+import pathlib
+import random
+import re
+import resource
+import shutil
+import tempfile
+import time
+
+from langchain_core.embeddings import Embeddings
+
+from db.chunk_map import ChunkMap
+from db.db_connection import DbConnection
+from db.lexical_index import LexicalIndex
+from benchmarks.synthetic import synthetic_text
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashEmbeddings(Embeddings):
+    def __init__(self, dimensions: int = 384) -> None:
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.dimensions
+        for token in _TOKEN_RE.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+
+def create_embedder(name: str) -> Embeddings:
+    if name == "hash":
+        return HashEmbeddings()
+    from db.embedders import create_embeddings
+    return create_embeddings(backend=name)
+
+
+def build_synthetic_corpus(conn: DbConnection, size: int, chunks_per_source: int, seed: int, batch_size: int) -> float:
+    rng = random.Random(seed)
+    collection = conn.db._collection
+    lexical = LexicalIndex(conn.db_path)
+    chunk_map = ChunkMap(conn.db_path)
+
+    started = time.perf_counter()
+    for start in range(0, size, batch_size):
+        ids, texts, metadatas = [], [], []
+        for i in range(start, min(start + batch_size, size)):
+            ids.append(f"synthetic-{i}")
+            texts.append(synthetic_text(rng))
+            metadatas.append({
+                "source": f"synthetic_{i // chunks_per_source}.pdf",
+                "chunk_index": i % chunks_per_source,
+                "page_number": (i % chunks_per_source) // 4 + 1,
+            })
+        collection.add(
+            ids=ids,
+            embeddings=conn.embeddings.embed_documents(texts),
+            documents=texts,
+            metadatas=metadatas
+        )
+        lexical.add(ids, texts)
+        chunk_map.add(ids, metadatas)
+    return time.perf_counter() - started
+
+
+def benchmark_ingestion(pdf_dir: str, persist_directory: str, embedder: Embeddings) -> dict:
+    from db import populate_db
+
+    populate_db.embedding_function = embedder
+    pdf_files = sorted(pathlib.Path(pdf_dir).glob("*.pdf"))
+
+    lexical = LexicalIndex(persist_directory)
+    chunks_before = lexical.count()
+    durations = []
+    for file_path in pdf_files:
+        started = time.perf_counter()
+        populate_db.add_single_document_to_db(str(file_path), persist_directory=persist_directory)
+        durations.append(time.perf_counter() - started)
+    chunks = lexical.count() - chunks_before
+
+    total = sum(durations)
+    return {
+        "documents": len(pdf_files),
+        "chunks": chunks,
+        "seconds": total,
+        "documents_per_second": len(pdf_files) / total if total else 0.0,
+        "chunks_per_second": chunks / total if total else 0.0,
+        "latency": _percentiles(durations),
+    }
+
+
+def _percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)] * 1000
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "mean_ms": sum(ordered) / len(ordered) * 1000}
+
+
+def _exact_top_k(matrix, vector, k: int) -> list[int]:
+    import numpy as np
+
+    query = np.asarray(vector, dtype=np.float32)
+    query /= np.linalg.norm(query) or 1.0
+    scores = matrix @ query
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])].tolist()
+
+
+def run_queries(conn: DbConnection, queries: list[str], k: int, fetch_k: int, neighbor_window: int, search_type: str) -> dict:
+    import numpy as np
+    from langchain_chroma.vectorstores import maximal_marginal_relevance
+    from langchain_core.documents import Document
+
+    stored = conn.db._collection.get(include=["embeddings"])
+    stored_ids = stored["ids"]
+    matrix = np.asarray(stored["embeddings"], dtype=np.float32)
+    matrix /= np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+    timings = {"embed": [], "ann": [], "rerank": [], "neighbors": [], "total": []}
+    recalls = []
+
+    for query in queries:
+        started = time.perf_counter()
+        vector = conn.embeddings.embed_query(query)
+        embedded = time.perf_counter()
+
+        results = conn.db._collection.query(
+            query_embeddings=[vector],
+            n_results=fetch_k,
+            include=["embeddings", "documents", "metadatas"]
+        )
+        ann_done = time.perf_counter()
+
+        candidates = [
+            Document(id=doc_id, page_content=text, metadata=meta or {})
+            for doc_id, text, meta in zip(results["ids"][0], results["documents"][0], results["metadatas"][0])
+        ]
+        if search_type == "hybrid":
+            base_docs = conn._hybrid_search(query, vector, k, fetch_k)
+        else:
+            selected = maximal_marginal_relevance(
+                np.array(vector, dtype=np.float32),
+                results["embeddings"][0],
+                k=k
+            )
+            base_docs = [candidates[i] for i in selected]
+        reranked = time.perf_counter()
+
+        conn._expand_neighbors([base_docs], neighbor_window)
+        finished = time.perf_counter()
+
+        timings["embed"].append(embedded - started)
+        timings["ann"].append(ann_done - embedded)
+        timings["rerank"].append(reranked - ann_done)
+        timings["neighbors"].append(finished - reranked)
+        timings["total"].append(finished - started)
+
+        exact = {stored_ids[i] for i in _exact_top_k(matrix, vector, k)}
+        approximate = set(results["ids"][0][:k])
+        recalls.append(len(exact & approximate) / len(exact) if exact else 1.0)
+
+    return {
+        "queries": len(queries),
+        "latency": {stage: _percentiles(samples) for stage, samples in timings.items()},
+        "recall_at_k": sum(recalls) / len(recalls) if recalls else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Офлайн бенчмарк поиска DbConnection.search")
+    parser.add_argument("--size", type=int, default=10_000, help="число синтетических чанков")
+    parser.add_argument("--chunks-per-source", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200, help="число синтетических запросов")
+    parser.add_argument("--query-file", help="файл с запросами, по одному на строку")
+    parser.add_argument("--pdf-dir", help="каталог с PDF для замера скорости add_single_document_to_db")
+    parser.add_argument("--embedder", default="hash", choices=["hash", "torch", "onnx"])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--neighbor-window", type=int, default=2)
+    parser.add_argument("--search-type", default="mmr", choices=["mmr", "hybrid"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    embedder = create_embedder(args.embedder)
+    workdir = tempfile.mkdtemp(prefix="retrieval_bench_")
+    report = {"config": vars(args)}
+
+    try:
+        if args.pdf_dir:
+            ingest_dir = tempfile.mkdtemp(dir=workdir)
+            report["ingestion"] = benchmark_ingestion(args.pdf_dir, ingest_dir, embedder)
+
+        conn = DbConnection(persist_directory=workdir, embeddings=embedder)
+        build_seconds = build_synthetic_corpus(conn, args.size, args.chunks_per_source, args.seed, args.batch_size)
+        report["corpus"] = {
+            "chunks": args.size,
+            "build_seconds": build_seconds,
+            "chunks_per_second": args.size / build_seconds if build_seconds else 0.0,
+        }
+
+        if args.query_file:
+            with open(args.query_file) as f:
+                queries = [line.strip() for line in f if line.strip()]
+        else:
+            rng = random.Random(args.seed + 1)
+            queries = [synthetic_text(rng, words=8) for _ in range(args.queries)]
+
+        report["search"] = run_queries(conn, queries, args.k, args.fetch_k, args.neighbor_window, args.search_type)
+        report["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+HEAVY_MODULES = [
+    "selenium",
+    "webdriver_manager",
+    "fake_useragent",
+    "langchain_chroma",
+    "langchain_huggingface",
+    "langchain_community",
+    "chromadb",
+    "sentence_transformers",
+    "torch",
+    "pypdf",
+    "docling",
+]
+
+PROBE = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+from source.main import app
+imported = time.perf_counter()
+
+async def startup():
+    async with app.router.lifespan_context(app):
+        return time.perf_counter()
+
+ready = asyncio.run(startup())
+print(json.dumps({
+    "import_seconds": imported - started,
+    "startup_seconds": ready - imported,
+    "ready_seconds": ready - started,
+    "heavy_modules": [m for m in HEAVY if m in sys.modules],
+}))
+"""
+
+
+def probe(root: str) -> dict:
+    code = f"HEAVY = {HEAVY_MODULES!r}\n{PROBE}"
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Замер времени импорта и старта API")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ready-seconds", type=float, default=1.0, help="порог для CI")
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = [probe(root) for _ in range(args.runs)]
+
+    report = {
+        "runs": args.runs,
+        "import_seconds": statistics.median(r["import_seconds"] for r in runs),
+        "startup_seconds": statistics.median(r["startup_seconds"] for r in runs),
+        "ready_seconds": statistics.median(r["ready_seconds"] for r in runs),
+        "heavy_modules": sorted({m for r in runs for m in r["heavy_modules"]}),
+    }
+    report["ok"] = report["ready_seconds"] <= args.max_ready_seconds and not report["heavy_modules"]
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if not report["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import random
+
+
+VOCABULARY = (
+    "blast furnace hydrogen reduction iron ore pellet sinter coke rate slag basicity wustite magnetite "
+    "hematite Fe2O3 Fe3O4 FeO CO CO2 H2 H2O gas utilization shaft tuyere raceway temperature kinetics "
+    "diffusion porosity softening melting cohesive zone burden distribution injection pulverized coal "
+    "natural gas oxygen enrichment productivity emissions carbon footprint equilibrium thermodynamics "
+    "activation energy reaction rate interface layer grain boundary metallization degree reducibility"
+).split()
+
+
+def synthetic_text(rng: random.Random, words: int = 120) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
@@ -0,0 +1,70 @@
+import os
+import sqlite3
+import threading
+
+
+CHUNK_MAP_FILE = "chunk_map.sqlite3"
+LOOKUP_BATCH = 400
+
+
+class ChunkMap:
+    """(source, chunk_index) -> id рядом с хранилищем: пишут его те же пути, что и Chroma."""
+
+    def __init__(self, persist_directory: str) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(persist_directory, CHUNK_MAP_FILE),
+            check_same_thread=False,
+            timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_map ("
+            "source TEXT NOT NULL, chunk_index INTEGER NOT NULL, id TEXT NOT NULL, "
+            "PRIMARY KEY (source, chunk_index))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunk_map_id ON chunk_map (id)")
+        self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM chunk_map").fetchone()[0]
+
+    def add(self, ids: list[str], metadatas: list[dict | None]) -> None:
+        rows = []
+        for doc_id, meta in zip(ids, metadatas):
+            if not meta or meta.get("source") is None or meta.get("chunk_index") is None:
+                continue
+            rows.append((str(meta["source"]), int(meta["chunk_index"]), doc_id))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunk_map (source, chunk_index, id) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def delete(self, ids: list[str]) -> None:
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunk_map WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def lookup(self, keys: list[tuple[str, int]]) -> dict[tuple[str, int], str]:
+        found: dict[tuple[str, int], str] = {}
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_BATCH):
+                batch = keys[start:start + LOOKUP_BATCH]
+                values = ", ".join("(?, ?)" for _ in batch)
+                params = [value for source, idx in batch for value in (str(source), int(idx))]
+                rows = self._conn.execute(
+                    f"WITH wanted (source, chunk_index) AS (VALUES {values}) "
+                    "SELECT m.source, m.chunk_index, m.id FROM wanted "
+                    "JOIN chunk_map m ON m.source = wanted.source AND m.chunk_index = wanted.chunk_index",
+                    params
+                ).fetchall()
+                for source, idx, doc_id in rows:
+                    found[(source, idx)] = doc_id
+        return found
@@ -1,71 +1,180 @@
 from langchain_core.documents import Document
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 
+from db.embedders import create_cached_embeddings
+from db.chunk_map import ChunkMap
+from db.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from source.services.metrics import span
+
 import os
 
-class DbConnection:
-    def __init__(self):
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
-        )
 
-        current_dir = os.path.dirname(os.path.abspath(__file__))
+VECTOR_STORE_PATH = os.getenv(
+    "VECTOR_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "vector_store")
+)
+LEXICAL_BACKFILL_BATCH = 1000
 
-        db_path = os.path.join(current_dir, "vector_store")
+
+class DbConnection:
+    def __init__(self, persist_directory: str = VECTOR_STORE_PATH, embeddings=None):
+        self.embeddings = embeddings if embeddings is not None else create_cached_embeddings()
+
+        db_path = persist_directory
 
         print(f"Подключение к БД по пути: {db_path}")
 
+        self.db_path = db_path
         self.db = Chroma(
             embedding_function=self.embeddings,
             persist_directory=db_path
         )
 
-    def search(self, query: str, k: int = 5, neighbor_window: int = 1) -> list[Document]:
-        retriever = self.db.as_retriever(
-            search_type="mmr",
-            search_kwargs={'k': k, 'fetch_k': 20}
-        )
-        base_docs: list[Document] = retriever.invoke(query)
+        self.lexical = LexicalIndex(db_path)
+
+        self.chunk_map = ChunkMap(db_path)
+        self._backfill_chunk_map()
+        self._backfill_lexical()
+
+    def _backfill_chunk_map(self) -> None:
+        # Хранилище, собранное до карты соседей, переносим один раз при открытии, а не в запросе
+        if self.chunk_map.count() or not self.db._collection.count():
+            return
+        print("Строю карту соседних чанков...")
+        results = self.db.get(include=["metadatas"])
+        self.chunk_map.add(results.get("ids", []) or [], results.get("metadatas", []) or [])
+
+    def _backfill_lexical(self) -> None:
+        # Без строки в BM25 чанк молча выпадает из гибридного поиска: дозаполняем только недостающие
+        ids = self.db.get(include=[]).get("ids", []) or []
+        missing = self.lexical.missing(ids)
+        if not missing:
+            return
+        print(f"Дозаполняю лексический индекс BM25: {len(missing)} чанков")
+        for start in range(0, len(missing), LEXICAL_BACKFILL_BATCH):
+            results = self.db.get(ids=missing[start:start + LEXICAL_BACKFILL_BATCH], include=["documents"])
+            self.lexical.add(results.get("ids", []) or [], results.get("documents", []) or [])
+
+    def search(
+            self,
+            query: str,
+            k: int = 5,
+            neighbor_window: int = 1,
+            search_type: str = "mmr",
+            fetch_k: int = 20
+    ) -> list[Document]:
+        with span("retrieval_stage_seconds", stage="embed"):
+            vector = self.embeddings.embed_query(query)
+
+        with span("retrieval_stage_seconds", stage=search_type):
+            if search_type == "hybrid":
+                base_docs = self._hybrid_search(query, vector, k, fetch_k)
+            elif search_type == "mmr":
+                base_docs = self.db.max_marginal_relevance_search_by_vector(vector, k=k, fetch_k=fetch_k)
+            else:
+                base_docs = self.db.similarity_search_by_vector(vector, k=k)
+
+        with span("retrieval_stage_seconds", stage="neighbors"):
+            return self._expand_neighbors([base_docs], neighbor_window)[0]
+
+    def search_batch(
+            self,
+            queries: list[str],
+            k: int = 5,
+            neighbor_window: int = 1,
+            search_type: str = "mmr",
+            fetch_k: int = 20
+    ) -> list[list[Document]]:
+        embed_queries = getattr(self.embeddings, "embed_queries", self.embeddings.embed_documents)
+        with span("retrieval_stage_seconds", stage="embed_batch"):
+            vectors = embed_queries(queries)
+
+        with span("retrieval_stage_seconds", stage=f"{search_type}_batch"):
+            if search_type == "hybrid":
+                base_batches = [
+                    self._hybrid_search(query, vector, k, fetch_k)
+                    for query, vector in zip(queries, vectors)
+                ]
+            else:
+                base_batches = [
+                    self.db.max_marginal_relevance_search_by_vector(vector, k=k, fetch_k=fetch_k)
+                    for vector in vectors
+                ]
 
-        if not base_docs or all("chunk_index" not in d.metadata for d in base_docs):
-            return base_docs
+        with span("retrieval_stage_seconds", stage="neighbors_batch"):
+            return self._expand_neighbors(base_batches, neighbor_window)
 
-        neighbors_by_source: dict[str, set[int]] = {}
-        for doc in base_docs:
-            source = doc.metadata.get("source")
-            idx = doc.metadata.get("chunk_index")
-            if source is None or idx is None:
+    def _hybrid_search(self, query: str, vector: list[float], k: int, fetch_k: int) -> list[Document]:
+        vector_docs = self.db.similarity_search_by_vector(vector, k=fetch_k)
+        by_id = {doc.id: doc for doc in vector_docs if doc.id}
+        lexical_ids = self.lexical.search(query, limit=fetch_k)
+
+        fused = reciprocal_rank_fusion([[doc.id for doc in vector_docs if doc.id], lexical_ids])[:k]
+
+        missing = [doc_id for doc_id in fused if doc_id not in by_id]
+        if missing:
+            results = self.db.get(ids=missing)
+            for doc_id, meta, text in zip(
+                    results.get("ids", []) or [],
+                    results.get("metadatas", []) or [],
+                    results.get("documents", []) or []
+            ):
+                by_id[doc_id] = Document(id=doc_id, page_content=text, metadata=meta or {})
+
+        return [by_id[doc_id] for doc_id in fused if doc_id in by_id]
+
+    def _expand_neighbors(self, base_batches: list[list[Document]], neighbor_window: int) -> list[list[Document]]:
+        batches: list[dict[tuple[str | None, int | None], Document] | None] = []
+        wanted: list[list[tuple[str, int]]] = []
+
+        for base_docs in base_batches:
+            for rank, doc in enumerate(base_docs):
+                doc.metadata["retrieval_rank"] = rank
+
+            if not base_docs or all("chunk_index" not in d.metadata for d in base_docs):
+                batches.append(None)
+                wanted.append([])
                 continue
-            idx = int(idx)
-            if source not in neighbors_by_source:
-                neighbors_by_source[source] = set()
-            for delta in range(-neighbor_window, neighbor_window + 1):
-                neighbors_by_source[source].add(idx + delta)
-
-        all_docs: dict[tuple[str | None, int | None], Document] = {}
-        for d in base_docs:
-            key = (d.metadata.get("source"), d.metadata.get("chunk_index"))
-            all_docs[key] = d
-
-        for source, indices in neighbors_by_source.items():
-
-            where = {
-                "$and": [
-                    {"source": source},
-                    {"chunk_index": {"$in": list(indices)}},
-                ]
-            }
-            results = self.db.get(where=where)
 
+            neighbors_by_source: dict[str, set[int]] = {}
+            for doc in base_docs:
+                source = doc.metadata.get("source")
+                idx = doc.metadata.get("chunk_index")
+                if source is None or idx is None:
+                    continue
+                idx = int(idx)
+                if source not in neighbors_by_source:
+                    neighbors_by_source[source] = set()
+                for delta in range(-neighbor_window, neighbor_window + 1):
+                    neighbors_by_source[source].add(idx + delta)
+
+            all_docs: dict[tuple[str | None, int | None], Document] = {}
+            for d in base_docs:
+                key = (d.metadata.get("source"), d.metadata.get("chunk_index"))
+                all_docs[key] = d
+
+            batch_wanted = []
+            for source, indices in neighbors_by_source.items():
+                for idx in indices:
+                    if (source, idx) not in all_docs:
+                        batch_wanted.append((source, idx))
+
+            batches.append(all_docs)
+            wanted.append(batch_wanted)
+
+        # Один поиск по карте соседей на все запросы пакета, затем один get по id
+        neighbor_ids = self.chunk_map.lookup([(str(source), idx) for batch in wanted for source, idx in batch])
+
+        fetched: dict[str, Document] = {}
+        if neighbor_ids:
+            results = self.db.get(ids=list(set(neighbor_ids.values())))
+
+            ids = results.get("ids", []) or []
             metadatas = results.get("metadatas", []) or []
             documents = results.get("documents", []) or []
 
-            for meta, text in zip(metadatas, documents):
-                key = (meta.get("source"), meta.get("chunk_index"))
-                if key not in all_docs:
-                    all_docs[key] = Document(page_content=text, metadata=meta)
+            for doc_id, meta, text in zip(ids, metadatas, documents):
+                fetched[doc_id] = Document(id=doc_id, page_content=text, metadata=meta)
 
         def sort_key(doc: Document):
             meta = doc.metadata or {}
@@ -75,8 +184,17 @@ class DbConnection:
                 int(meta.get("chunk_index", 0) or 0),
             )
 
-        sorted_docs = sorted(all_docs.values(), key=sort_key)
-        return sorted_docs
+        expanded = []
+        for base_docs, all_docs, batch_wanted in zip(base_batches, batches, wanted):
+            if all_docs is None:
+                expanded.append(base_docs)
+                continue
+            for key in batch_wanted:
+                doc = fetched.get(neighbor_ids.get((str(key[0]), key[1])))
+                if doc is not None and key not in all_docs:
+                    all_docs[key] = doc
+            expanded.append(sorted(all_docs.values(), key=sort_key))
+        return expanded
 
 
 if __name__ == "__main__":
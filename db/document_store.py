@@ -0,0 +1,104 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+INGEST_CLAIM_TIMEOUT = 3600
+
+
+class DocumentStore:
+    def __init__(self, root_dir: str) -> None:
+        self.root_dir = root_dir
+        self.tmp_dir = os.path.join(root_dir, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root_dir, "catalog.sqlite3"), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "sha256 TEXT PRIMARY KEY, "
+            "path TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "source_url TEXT, "
+            "status TEXT NOT NULL, "
+            "chunks INTEGER, "
+            "error TEXT, "
+            "updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.root_dir, sha256[:2], f"{sha256}.pdf")
+
+    def write_stream(self, chunks, source_url: str | None = None) -> dict:
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+
+            sha256 = digest.hexdigest()
+            path = self.path_for(sha256)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO documents (sha256, path, size, source_url, status, updated_at) "
+                "VALUES (?, ?, ?, ?, 'downloaded', ?)",
+                (sha256, path, size, source_url, time.time())
+            )
+            self._conn.commit()
+        return {"sha256": sha256, "path": path, "size": size}
+
+    def get(self, sha256: str) -> dict | None:
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM documents WHERE sha256 = ?", (sha256,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([c[0] for c in cursor.description], row))
+
+    def claim(self, sha256: str) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE documents SET status = 'ingesting', error = NULL, updated_at = ? "
+                "WHERE sha256 = ? AND (status IN ('downloaded', 'failed') "
+                "OR (status = 'ingesting' AND updated_at < ?))",
+                (now, sha256, now - INGEST_CLAIM_TIMEOUT)
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def mark_ingested(self, sha256: str, chunks: int) -> None:
+        self._set_status(sha256, "ingested", chunks=chunks)
+
+    def mark_failed(self, sha256: str, error: str) -> None:
+        self._set_status(sha256, "failed", error=error)
+
+    def _set_status(self, sha256: str, status: str, chunks: int | None = None, error: str | None = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE documents SET status = ?, chunks = COALESCE(?, chunks), error = ?, updated_at = ? "
+                "WHERE sha256 = ?",
+                (status, chunks, error, time.time(), sha256)
+            )
+            self._conn.commit()
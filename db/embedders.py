@@ -0,0 +1,160 @@
+import math
+import os
+
+from langchain_core.embeddings import Embeddings
+
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+EMBEDDING_MAX_LENGTH = 256
+
+ONNX_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx_models")
+
+
+def _batches(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class OnnxEmbeddings(Embeddings):
+    def __init__(
+            self,
+            model_name: str = EMBEDDING_MODEL_NAME,
+            batch_size: int = EMBEDDING_BATCH_SIZE,
+            threads: int = EMBEDDING_THREADS,
+            quantize: bool = True
+    ) -> None:
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        model_path = hf_hub_download(model_name, "onnx/model.onnx")
+        if quantize:
+            model_path = self._quantize(model_path)
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _quantize(self, model_path: str) -> str:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        os.makedirs(ONNX_CACHE_DIR, exist_ok=True)
+        target = os.path.join(ONNX_CACHE_DIR, self.model_name.replace("/", "__") + "-int8.onnx")
+        if not os.path.exists(target):
+            print(f"Квантование модели {self.model_name} в int8...")
+            tmp_target = target + ".tmp"
+            quantize_dynamic(model_path, tmp_target, weight_type=QuantType.QInt8)
+            os.replace(tmp_target, target)
+        return target
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        import numpy as np
+
+        vectors: list[list[float]] = []
+        for batch in _batches(texts, self.batch_size):
+            encoded = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=EMBEDDING_MAX_LENGTH,
+                return_tensors="np"
+            )
+            feeds = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            vectors.extend(pooled.tolist())
+        return vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed([text])[0]
+
+
+def create_embeddings(
+        backend: str = EMBEDDING_BACKEND,
+        model_name: str = EMBEDDING_MODEL_NAME,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        threads: int = EMBEDDING_THREADS
+) -> Embeddings:
+    if backend == "onnx":
+        return OnnxEmbeddings(model_name=model_name, batch_size=batch_size, threads=threads)
+    if backend != "torch":
+        raise ValueError(f"Неизвестный бэкенд эмбеддингов: {backend}")
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'batch_size': batch_size}
+    )
+
+
+def embeddings_id(backend: str = EMBEDDING_BACKEND, model_name: str = EMBEDDING_MODEL_NAME) -> str:
+    return model_name if backend == "torch" else f"{model_name}:{backend}-int8"
+
+
+def create_cached_embeddings(
+        backend: str = EMBEDDING_BACKEND,
+        model_name: str = EMBEDDING_MODEL_NAME,
+        socket_path: str | None = None
+):
+    from db.embedding_cache import CachedEmbeddings
+    from db.embedding_server import EMBEDDING_SOCKET, RemoteEmbeddings
+
+    # Если на узле запущен сервер эмбеддингов, модель и кэш живут в нём
+    socket_path = EMBEDDING_SOCKET if socket_path is None else socket_path
+    if socket_path:
+        return RemoteEmbeddings(socket_path)
+
+    return CachedEmbeddings(
+        create_embeddings(backend=backend, model_name=model_name),
+        model_name=embeddings_id(backend=backend, model_name=model_name)
+    )
+
+
+def _cosine(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def parity_check(texts: list[str], reference: Embeddings, candidate: Embeddings) -> dict:
+    expected = reference.embed_documents(texts)
+    actual = candidate.embed_documents(texts)
+    similarities = [_cosine(a, b) for a, b in zip(expected, actual)]
+    return {
+        "texts": len(texts),
+        "mean_cosine": sum(similarities) / len(similarities),
+        "min_cosine": min(similarities),
+        "max_drift": 1.0 - min(similarities),
+    }
+
+
+if __name__ == "__main__":
+    sample = [
+        "Theoretical Analyses of Hydrogen-rich Reduction in Blast Furnace",
+        "Fe2O3 + 3CO → 2Fe + 3CO2",
+        "Влияние водорода на восстановление железорудных окатышей",
+        "The coke rate decreases as the hydrogen injection ratio increases.",
+    ]
+    print(parity_check(sample, create_embeddings("torch"), create_embeddings("onnx")))
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache.sqlite3")
+# Файл кэша общий для всех процессов Celery: писатель ждёт блокировку, а не падает сразу
+CACHE_BUSY_TIMEOUT = float(os.getenv("EMBEDDING_CACHE_BUSY_TIMEOUT", "5"))
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(
+            self,
+            embeddings: Embeddings,
+            model_name: str,
+            max_memory_items: int = 10_000,
+            cache_path: str | None = DEFAULT_CACHE_PATH
+    ) -> None:
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_memory_items = max_memory_items
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._conn = None
+        if cache_path:
+            self._conn = sqlite3.connect(cache_path, check_same_thread=False, timeout=CACHE_BUSY_TIMEOUT)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self._check_model()
+
+    def _check_model(self) -> None:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'model_name'").fetchone()
+        if row is not None and row[0] == self.model_name:
+            return
+        if row is not None:
+            print(f"Модель эмбеддингов изменилась ({row[0]} -> {self.model_name}), очищаю кэш")
+        self._conn.execute("DELETE FROM embeddings")
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('model_name', ?)", (self.model_name,))
+        self._conn.commit()
+
+    def _key(self, text: str, kind: str) -> str:
+        raw = f"{self.model_name}\0{kind}\0{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: list[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys: list[str]) -> dict[str, list[float]]:
+        found: dict[str, list[float]] = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                else:
+                    missing.append(key)
+
+            if missing and self._conn is not None:
+                unique = list(dict.fromkeys(missing))
+                try:
+                    for start in range(0, len(unique), 500):
+                        batch = unique[start:start + 500]
+                        placeholders = ",".join("?" * len(batch))
+                        rows = self._conn.execute(
+                            f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                        ).fetchall()
+                        for key, blob in rows:
+                            vector = array("f", blob).tolist()
+                            found[key] = vector
+                            self._remember(key, vector)
+                            self.disk_hits += 1
+                except sqlite3.OperationalError as e:
+                    print(f"Кэш эмбеддингов на диске недоступен, считаю без него: {e}")
+
+            self.hits += len(keys) - len(missing)
+            self.misses += sum(1 for key in missing if key not in found)
+        return found
+
+    def _store(self, items: dict[str, list[float]]) -> None:
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+            if self._conn is None:
+                return
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                    [(key, array("f", vector).tobytes()) for key, vector in items.items()]
+                )
+                self._conn.commit()
+            except sqlite3.OperationalError as e:
+                # Векторы уже посчитаны: без записи на диск эмбеддинг всё равно должен вернуться
+                self._conn.rollback()
+                print(f"Не удалось записать кэш эмбеддингов: {e}")
+
+    def _embed_many(self, texts: list[str], kind: str) -> list[list[float]]:
+        keys = [self._key(text, kind) for text in texts]
+        found = self._lookup(keys)
+
+        to_embed: dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in to_embed:
+                to_embed[key] = text
+
+        if to_embed:
+            vectors = self.embeddings.embed_documents(list(to_embed.values()))
+            computed = dict(zip(to_embed.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed_many(texts, "document")
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return self._embed_many(texts, "query")
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self._key(text, "query")
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+
+        vector = self.embeddings.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_items": len(self._memory),
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM embeddings")
+                self._conn.commit()
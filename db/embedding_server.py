@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+
+EMBEDDING_SOCKET = os.getenv("EMBEDDING_SOCKET", "")
+EMBEDDING_SERVER_MAX_BATCH = int(os.getenv("EMBEDDING_SERVER_MAX_BATCH", "64"))
+EMBEDDING_SERVER_MAX_WAIT_MS = float(os.getenv("EMBEDDING_SERVER_MAX_WAIT_MS", "5"))
+EMBEDDING_CLIENT_CHUNK = 256
+
+# Протокол поверх Unix-сокета, без JSON:
+#   запрос:  kind (B: 0 - документы, 1 - запрос), n (I), n длин (I), тексты в utf-8 подряд
+#   ответ:   status (B: 0 - ok, 1 - ошибка), rows (I), dim (I), затем rows * dim float32
+#            в порядке байт машины; при ошибке вместо векторов - текст ошибки длиной rows
+KIND_DOCUMENTS = 0
+KIND_QUERY = 1
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+REQUEST_HEADER = struct.Struct("!BI")
+RESPONSE_HEADER = struct.Struct("!BII")
+
+
+class EmbeddingServerError(RuntimeError):
+    pass
+
+
+def encode_request(kind: int, texts: list[str]) -> bytes:
+    encoded = [text.encode("utf-8") for text in texts]
+    lengths = struct.pack(f"!{len(encoded)}I", *(len(item) for item in encoded))
+    return REQUEST_HEADER.pack(kind, len(encoded)) + lengths + b"".join(encoded)
+
+
+def encode_vectors(vectors: list[list[float]]) -> list[bytes]:
+    dim = len(vectors[0]) if vectors else 0
+    payload = array("f")
+    for vector in vectors:
+        payload.extend(vector)
+    return [RESPONSE_HEADER.pack(STATUS_OK, len(vectors), dim), memoryview(payload).cast("B")]
+
+
+def encode_error(message: str) -> list[bytes]:
+    encoded = message.encode("utf-8")
+    return [RESPONSE_HEADER.pack(STATUS_ERROR, len(encoded), 0), encoded]
+
+
+class EmbeddingServer:
+    """Один экземпляр модели на узел: собирает параллельные запросы в микро-батчи."""
+
+    def __init__(
+            self,
+            embeddings: Embeddings,
+            socket_path: str,
+            max_batch: int = EMBEDDING_SERVER_MAX_BATCH,
+            max_wait_ms: float = EMBEDDING_SERVER_MAX_WAIT_MS
+    ) -> None:
+        self.embeddings = embeddings
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+
+        self.batches = 0
+        self.texts = 0
+
+        self._queue: asyncio.Queue | None = None
+        # Модель сама распараллеливает батч по ядрам, поэтому считаем строго по одному батчу
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+
+    async def _collect(self) -> list[tuple[int, list[str], asyncio.Future]]:
+        first = await self._queue.get()
+        pending = [first]
+        size = len(first[1])
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            pending.append(item)
+            size += len(item[1])
+        return pending
+
+    def _embed(self, kind: int, texts: list[str]) -> list[list[float]]:
+        # У MiniLM запросы и документы кодируются одинаково, поэтому без embed_queries
+        # пачку запросов тоже считаем одним вызовом embed_documents
+        if kind == KIND_QUERY and hasattr(self.embeddings, "embed_queries"):
+            return self.embeddings.embed_queries(texts)
+        return self.embeddings.embed_documents(texts)
+
+    async def _batch_loop(self) -> None:
+        from source.services.metrics import observe
+
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = await self._collect()
+            for kind in (KIND_QUERY, KIND_DOCUMENTS):
+                group = [item for item in pending if item[0] == kind]
+                if not group:
+                    continue
+
+                texts = [text for _, item_texts, _ in group for text in item_texts]
+                started = time.perf_counter()
+                try:
+                    vectors = await loop.run_in_executor(self._executor, self._embed, kind, texts)
+                except Exception as e:
+                    for _, _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                elapsed = time.perf_counter() - started
+                self.batches += 1
+                self.texts += len(texts)
+
+                offset = 0
+                for _, item_texts, future in group:
+                    if not future.done():
+                        future.set_result(vectors[offset:offset + len(item_texts)])
+                    offset += len(item_texts)
+
+                loop.run_in_executor(None, observe, "embedding_batch_seconds", elapsed)
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> tuple[int, list[str]]:
+        kind, count = REQUEST_HEADER.unpack(await reader.readexactly(REQUEST_HEADER.size))
+        lengths = struct.unpack(f"!{count}I", await reader.readexactly(4 * count)) if count else ()
+        payload = await reader.readexactly(sum(lengths)) if count else b""
+
+        texts = []
+        offset = 0
+        for length in lengths:
+            texts.append(payload[offset:offset + length].decode("utf-8"))
+            offset += length
+        return kind, texts
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    kind, texts = await self._read_request(reader)
+                except asyncio.IncompleteReadError:
+                    break
+
+                if not texts:
+                    writer.writelines(encode_vectors([]))
+                else:
+                    future = loop.create_future()
+                    await self._queue.put((kind, texts, future))
+                    try:
+                        writer.writelines(encode_vectors(await future))
+                    except Exception as e:
+                        writer.writelines(encode_error(str(e)))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self) -> None:
+        self._queue = asyncio.Queue()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        batcher = asyncio.create_task(self._batch_loop())
+        print(f"Сервер эмбеддингов слушает {self.socket_path} "
+              f"(батч до {self.max_batch}, ожидание до {self.max_wait * 1000:.1f} мс)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self._executor.shutdown(wait=False)
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+class RemoteEmbeddings(Embeddings):
+    """Клиент сервера эмбеддингов для слота embedding_function в Chroma(...)."""
+
+    def __init__(self, socket_path: str = EMBEDDING_SOCKET, timeout: float = 60.0) -> None:
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _drop(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    @staticmethod
+    def _recv_exactly(sock: socket.socket, size: int) -> bytearray:
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            n = sock.recv_into(view[received:], size - received)
+            if n == 0:
+                raise ConnectionError("Сервер эмбеддингов закрыл соединение")
+            received += n
+        return buffer
+
+    def _request(self, kind: int, texts: list[str]) -> list[list[float]]:
+        request = encode_request(kind, texts)
+        for attempt in range(2):
+            try:
+                sock = self._connect()
+                sock.sendall(request)
+                status, rows, dim = RESPONSE_HEADER.unpack(self._recv_exactly(sock, RESPONSE_HEADER.size))
+                payload = self._recv_exactly(sock, rows if status == STATUS_ERROR else rows * dim * 4)
+                break
+            except (ConnectionError, socket.timeout, FileNotFoundError):
+                self._drop()
+                if attempt:
+                    raise
+
+        if status == STATUS_ERROR:
+            raise EmbeddingServerError(payload.decode("utf-8"))
+
+        flat = memoryview(payload).cast("f")
+        return [flat[row * dim:(row + 1) * dim].tolist() for row in range(rows)]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors: list[list[float]] = []
+        for start in range(0, len(texts), EMBEDDING_CLIENT_CHUNK):
+            vectors.extend(self._request(KIND_DOCUMENTS, texts[start:start + EMBEDDING_CLIENT_CHUNK]))
+        return vectors
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        vectors: list[list[float]] = []
+        for start in range(0, len(texts), EMBEDDING_CLIENT_CHUNK):
+            vectors.extend(self._request(KIND_QUERY, texts[start:start + EMBEDDING_CLIENT_CHUNK]))
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._request(KIND_QUERY, [text])[0]
+
+    def close(self) -> None:
+        self._drop()
+
+
+def main() -> None:
+    from db.embedders import create_cached_embeddings
+
+    parser = argparse.ArgumentParser(description="Общий сервер эмбеддингов на Unix-сокете")
+    parser.add_argument("--socket", default=EMBEDDING_SOCKET or "/tmp/embeddings.sock")
+    parser.add_argument("--max-batch", type=int, default=EMBEDDING_SERVER_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=EMBEDDING_SERVER_MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    print("Loading Embedding Model...")
+    server = EmbeddingServer(
+        create_cached_embeddings(socket_path=""),
+        socket_path=args.socket,
+        max_batch=args.max_batch,
+        max_wait_ms=args.max_wait_ms
+    )
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        print(f"Сервер эмбеддингов остановлен: батчей {server.batches}, текстов {server.texts}")
+
+
+if __name__ == "__main__":
+    main()
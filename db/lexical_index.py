@@ -0,0 +1,109 @@
+import os
+import re
+import sqlite3
+import threading
+
+
+LEXICAL_INDEX_FILE = "lexical_index.sqlite3"
+MISSING_BATCH = 500
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _match_expression(query: str) -> str | None:
+    tokens = list(dict.fromkeys(token.lower() for token in _TOKEN_RE.findall(query)))
+    if not tokens:
+        return None
+    return " OR ".join(f'"{token}"' for token in tokens)
+
+
+class LexicalIndex:
+    def __init__(self, persist_directory: str) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(persist_directory, LEXICAL_INDEX_FILE),
+            check_same_thread=False,
+            timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+            "id UNINDEXED, body, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        # Колонка id в FTS5 не индексируется, поэтому удаление по ней - полный проход по таблице.
+        # Отображение id -> rowid с первичным ключом даёт удаление по rowid за O(log n)
+        created = self._conn.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'chunk_rowids'"
+        ).fetchone()[0] == 0
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_rowids (id TEXT PRIMARY KEY, chunk_rowid INTEGER NOT NULL)"
+        )
+        if created:
+            # Индекс, собранный до появления таблицы отображения, переносим один раз
+            self._conn.execute("INSERT OR REPLACE INTO chunk_rowids (id, chunk_rowid) SELECT id, rowid FROM chunks")
+        self._conn.commit()
+
+    def _delete_ids(self, ids: list[str]) -> None:
+        rowids = []
+        for doc_id in ids:
+            row = self._conn.execute("SELECT chunk_rowid FROM chunk_rowids WHERE id = ?", (doc_id,)).fetchone()
+            if row is not None:
+                rowids.append(row)
+        self._conn.executemany("DELETE FROM chunks WHERE rowid = ?", rowids)
+        self._conn.executemany("DELETE FROM chunk_rowids WHERE id = ?", [(i,) for i in ids])
+
+    def missing(self, ids: list[str]) -> list[str]:
+        present: set[str] = set()
+        with self._lock:
+            for start in range(0, len(ids), MISSING_BATCH):
+                batch = ids[start:start + MISSING_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT id FROM chunk_rowids WHERE id IN ({placeholders})", batch
+                ).fetchall()
+                present.update(row[0] for row in rows)
+        return [doc_id for doc_id in ids if doc_id not in present]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM chunks").fetchone()[0]
+
+    def add(self, ids: list[str], texts: list[str]) -> None:
+        with self._lock:
+            self._delete_ids(ids)
+            for doc_id, text in zip(ids, texts):
+                cursor = self._conn.execute("INSERT INTO chunks (id, body) VALUES (?, ?)", (doc_id, text))
+                self._conn.execute(
+                    "INSERT INTO chunk_rowids (id, chunk_rowid) VALUES (?, ?)", (doc_id, cursor.lastrowid)
+                )
+            self._conn.commit()
+
+    def delete(self, ids: list[str]) -> None:
+        with self._lock:
+            self._delete_ids(ids)
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM chunk_rowids")
+            self._conn.commit()
+
+    def search(self, query: str, limit: int = 20) -> list[str]:
+        expression = _match_expression(query)
+        if expression is None:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM chunks WHERE chunks MATCH ? ORDER BY bm25(chunks) LIMIT ?",
+                (expression, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[str]:
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -1,35 +1,37 @@
 import os
 import hashlib
 
-from fastapi import FastAPI
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.documents import Document
 from langchain_chroma import Chroma
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from contextlib import asynccontextmanager
 
+from db.chunk_map import ChunkMap
+from db.db_connection import VECTOR_STORE_PATH
+from db.embedders import create_cached_embeddings
+from langchain_core.embeddings import Embeddings
+from db.lexical_index import LexicalIndex
+from source.services.metrics import span, timed
+
+
+UPSERT_BATCH_SIZE = 256
 
 embedding_function = None
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
+
+def _create_embedding_function() -> Embeddings:
+    return create_cached_embeddings()
+
+
+def get_embedding_function() -> Embeddings:
     global embedding_function
-    try:
+    if embedding_function is None:
         print("Loading Embedding Model...")
-        embedding_function = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
-        )
-        yield
-    except Exception as e:
-        print(f"Произошла ошибка при загрузки модели: {e}")
-    finally:
-        print("Освобождаю ресурсы от модели")
-        if not embedding_function is None:
-            embedding_function = None
+        embedding_function = _create_embedding_function()
+    return embedding_function
 
 
-def add_single_document_to_db(file_path: str, persist_directory: str = "vector_store") -> None:
+def load_chunks(file_path: str) -> list[Document] | None:
     print(f"Processing file: {file_path}")
 
     try:
@@ -37,31 +39,144 @@ def add_single_document_to_db(file_path: str, persist_directory: str = "vector_s
         docs = loader.load()
     except Exception as e:
         print(f"Error loading PDF: {e}")
-        return
+        return None
 
     if not docs:
         print("Document is empty.")
-        return
+        return None
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = text_splitter.split_documents(docs)
+    chunks = split_pages(docs)
 
     print(f"Generated {len(chunks)} chunks.")
 
     filename = os.path.basename(file_path)
-    ids = [f"{filename}_{i}" for i in range(len(chunks))]
-
     for chunk in chunks:
         chunk.metadata["source_filename"] = filename
 
-    db = Chroma(
-        persist_directory=persist_directory,
-        embedding_function=embedding_function
-    )
+    return chunks
+
+
+def split_pages(docs: list[Document]) -> list[Document]:
+    """Режет страницы на чанки с перекрытием и нумерует их сквозным chunk_index."""
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    chunks = text_splitter.split_documents(docs)
+    # По chunk_index соседние чанки находят друг друга при расширении окна и склейке перекрытий
+    for i, chunk in enumerate(chunks):
+        chunk.metadata["chunk_index"] = i
+    return chunks
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stable_chunk_ids(doc_hash: str, chunks: list[Document]) -> list[str]:
+    ids = []
+    seen: dict[str, int] = {}
+    for chunk in chunks:
+        chunk_hash = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()[:16]
+        occurrence = seen.get(chunk_hash, 0)
+        seen[chunk_hash] = occurrence + 1
+
+        chunk_id = f"{doc_hash[:16]}-{chunk_hash}"
+        if occurrence:
+            chunk_id = f"{chunk_id}-{occurrence}"
+        ids.append(chunk_id)
+        chunk.metadata["doc_hash"] = doc_hash
+    return ids
+
+
+def _open_db(persist_directory: str) -> Chroma:
+    # Векторы в коллекцию пишутся явно, поэтому модель Chroma не нужна:
+    # upsert-воркер с готовыми эмбеддингами не должен её загружать
+    return Chroma(persist_directory=persist_directory)
+
+
+def _existing_ids(db: Chroma, doc_hash: str) -> set[str]:
+    results = db.get(where={"doc_hash": doc_hash}, include=[])
+    return set(results.get("ids", []) or [])
+
+
+def existing_chunk_ids(doc_hash: str, persist_directory: str = VECTOR_STORE_PATH) -> set[str]:
+    return _existing_ids(_open_db(persist_directory), doc_hash)
+
+
+def _batches(items: list, size: int = UPSERT_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+@timed("ingest_stage_seconds", stage="sync")
+def sync_document(
+        doc_hash: str,
+        chunks: list[Document],
+        ids: list[str],
+        embeddings: dict[str, list[float]] | None = None,
+        persist_directory: str = VECTOR_STORE_PATH,
+        embedder: Embeddings | None = None
+) -> dict:
+    db = _open_db(persist_directory)
+    collection = db._collection
+    existing = _existing_ids(db, doc_hash)
+
+    embeddings = dict(embeddings or {})
+    new_positions = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing]
+    kept_positions = [i for i, chunk_id in enumerate(ids) if chunk_id in existing]
+    orphans = sorted(existing - set(ids))
+
+    missing = [i for i in new_positions if ids[i] not in embeddings]
+    if missing:
+        with span("ingest_stage_seconds", stage="embed"):
+            vectors = (embedder or get_embedding_function()).embed_documents([chunks[i].page_content for i in missing])
+        embeddings.update({ids[i]: vector for i, vector in zip(missing, vectors)})
+
+    for batch in _batches(new_positions):
+        collection.add(
+            ids=[ids[i] for i in batch],
+            embeddings=[embeddings[ids[i]] for i in batch],
+            documents=[chunks[i].page_content for i in batch],
+            metadatas=[chunks[i].metadata for i in batch]
+        )
+
+    for batch in _batches(kept_positions):
+        collection.update(
+            ids=[ids[i] for i in batch],
+            metadatas=[chunks[i].metadata for i in batch]
+        )
+
+    for batch in _batches(orphans):
+        collection.delete(ids=batch)
+
+    lexical = LexicalIndex(persist_directory)
+    # Сохранённые чанки тоже индексируем, если их нет в BM25 (хранилище старше индекса)
+    kept_missing = set(lexical.missing([ids[i] for i in kept_positions]))
+    lexical_positions = new_positions + [i for i in kept_positions if ids[i] in kept_missing]
+    lexical.add([ids[i] for i in lexical_positions], [chunks[i].page_content for i in lexical_positions])
+    lexical.delete(orphans)
+
+    # Воркеры читают соседей прямо из карты, поэтому после записи им нечего перестраивать
+    chunk_map = ChunkMap(persist_directory)
+    chunk_map.delete(orphans)
+    chunk_map.add(ids, [chunk.metadata for chunk in chunks])
+
+    return {"added": len(new_positions), "updated": len(kept_positions), "deleted": len(orphans)}
+
+
+def add_single_document_to_db(file_path: str, persist_directory: str = VECTOR_STORE_PATH) -> None:
+    with span("ingest_stage_seconds", stage="parse"):
+        chunks = load_chunks(file_path)
+    if not chunks:
+        return
+
+    filename = os.path.basename(file_path)
+    doc_hash = file_sha256(file_path)
 
     try:
-        db.add_documents(documents=chunks, ids=ids)
-        print(f"Successfully added {len(chunks)} chunks to DB from {filename}")
-        os.remove("../data_sources/scraped_article.pdf")
+        stats = sync_document(doc_hash, chunks, stable_chunk_ids(doc_hash, chunks), persist_directory=persist_directory)
+        print(f"Successfully synced {len(chunks)} chunks to DB from {filename}: {stats}")
     except Exception as e:
-        print(f"Error writing to Vector DB: {e}")
\ No newline at end of file
+        print(f"Error writing to Vector DB: {e}")
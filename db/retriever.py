@@ -0,0 +1,57 @@
+import os
+import threading
+
+from db.db_connection import DbConnection
+from source.services.metrics import span
+
+
+_retriever: DbConnection | None = None
+_warm = False
+_lock = threading.Lock()
+
+WARMUP_QUERY = "warmup"
+
+SEARCH_KWARGS = {
+    "k": int(os.getenv("RETRIEVAL_K", "5")),
+    "fetch_k": int(os.getenv("RETRIEVAL_FETCH_K", "20")),
+    "neighbor_window": int(os.getenv("RETRIEVAL_NEIGHBOR_WINDOW", "2")),
+    "search_type": os.getenv("RETRIEVAL_SEARCH_TYPE", "mmr"),
+}
+
+
+def init_retriever() -> DbConnection:
+    global _retriever, _warm
+    with _lock:
+        if _retriever is not None:
+            return _retriever
+
+        print("Загрузка ретривера для процесса...")
+        with span("model_load_seconds"):
+            retriever = DbConnection()
+        try:
+            retriever.search(WARMUP_QUERY, k=1, neighbor_window=0)
+            _warm = True
+        except Exception as e:
+            print(f"Не удалось прогреть ретривер: {e}")
+        _retriever = retriever
+        return _retriever
+
+
+def get_retriever() -> DbConnection:
+    if _retriever is not None:
+        return _retriever
+    return init_retriever()
+
+
+def close_retriever() -> None:
+    global _retriever, _warm
+    with _lock:
+        if _retriever is None:
+            return
+        print("Освобождаю ресурсы ретривера")
+        _retriever = None
+        _warm = False
+
+
+def is_retriever_warm() -> bool:
+    return _retriever is not None and _warm
@@ -1,6 +1,12 @@
+import json
+import os
 import pathlib
 import re
-from collections import defaultdict
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 
 from langchain_core.documents import Document
 from langchain_community.vectorstores.utils import filter_complex_metadata
@@ -10,6 +16,102 @@ from docling.datamodel.base_models import InputFormat
 from docling.datamodel.pipeline_options import PdfPipelineOptions, RapidOcrOptions
 from docling.chunking import HybridChunker
 
+from db.embedders import EMBEDDING_MODEL_NAME
+
+
+# Пре-проход по текстовому слою: OCR только для сканов и страниц почти без текста,
+# распознавание таблиц только там, где похоже на таблицу
+DOCLING_PREPASS = os.getenv("DOCLING_PREPASS", "1") == "1"
+OCR_MIN_CHARS = int(os.getenv("DOCLING_OCR_MIN_CHARS", "200"))
+PAGES_PER_RANGE = int(os.getenv("DOCLING_PAGES_PER_RANGE", "8"))
+# Профили (ocr, tables), которые даёт план страниц: страница под OCR всегда идёт и с таблицами
+CONVERTER_PROFILES = [(False, False), (False, True), (True, True)]
+# Каждый конвертер держит свою копию layout-модели (и OCR/TableFormer, если включены).
+# По умолчанию в кэш помещаются все профили: иначе смешанный файл вытесняет конвертеры
+# по кругу и грузит модели заново. Меньший предел экономит память ценой такой перезагрузки
+DOCLING_MAX_CONVERTERS = int(os.getenv("DOCLING_MAX_CONVERTERS", str(len(CONVERTER_PROFILES))))
+
+TABLE_CAPTION_RE = re.compile(r"^\s*(Table|Tab\.|Таблица)\s*[\dIVX]+", re.IGNORECASE | re.MULTILINE)
+NUMBER_RE = re.compile(r"^[-+±]?\d+(?:[.,]\d+)?%?$")
+TABLE_MIN_NUMERIC_ROWS = 4
+
+
+@dataclass(frozen=True)
+class PageRange:
+    start: int
+    end: int
+    ocr: bool
+    tables: bool
+
+    @property
+    def pages(self) -> int:
+        return self.end - self.start + 1
+
+
+def _looks_like_table(text: str) -> bool:
+    if TABLE_CAPTION_RE.search(text):
+        return True
+    numeric_rows = 0
+    for line in text.splitlines():
+        if sum(1 for token in line.split() if NUMBER_RE.match(token)) >= 3:
+            numeric_rows += 1
+            if numeric_rows >= TABLE_MIN_NUMERIC_ROWS:
+                return True
+    return False
+
+
+def analyze_pages(file_path: pathlib.Path) -> list[tuple[bool, bool]]:
+    """Для каждой страницы: (нужен ли OCR, есть ли кандидат в таблицы)."""
+    import pypdfium2 as pdfium
+
+    profile = []
+    pdf = pdfium.PdfDocument(str(file_path))
+    try:
+        for index in range(len(pdf)):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            text = textpage.get_text_range()
+            textpage.close()
+            page.close()
+
+            needs_ocr = len(text.strip()) < OCR_MIN_CHARS
+            # На скане текста нет, поэтому и таблицы по нему не угадать
+            profile.append((needs_ocr, needs_ocr or _looks_like_table(text)))
+    finally:
+        pdf.close()
+    return profile
+
+
+def plan_page_ranges(
+        file_path: pathlib.Path,
+        prepass: bool = DOCLING_PREPASS,
+        pages_per_range: int = PAGES_PER_RANGE
+) -> list[PageRange]:
+    if prepass:
+        profile = analyze_pages(file_path)
+    else:
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(str(file_path))
+        profile = [(True, True)] * len(pdf)
+        pdf.close()
+
+    ranges: list[PageRange] = []
+    for page_no, (ocr, tables) in enumerate(profile, start=1):
+        last = ranges[-1] if ranges else None
+        if last and (last.ocr, last.tables) == (ocr, tables) and last.pages < pages_per_range:
+            ranges[-1] = PageRange(last.start, page_no, ocr, tables)
+        else:
+            ranges.append(PageRange(page_no, page_no, ocr, tables))
+    return ranges
+
+
+def merge_ranges(parts: list[list[Document]]) -> list[Document]:
+    """Склеивает чанки диапазонов в порядке страниц со сквозным chunk_index."""
+    elements = [doc for part in parts for doc in part]
+    for i, doc in enumerate(elements):
+        doc.metadata["chunk_index"] = i
+    return elements
+
 
 def normalize_formulas(text: str) -> str:
     if not text:
@@ -20,75 +122,189 @@ def normalize_formulas(text: str) -> str:
     return text
 
 
+_worker_chunk = None
+_worker_chunker = None
+
+
+def _init_bulk_worker(
+        source_directory: str,
+        persist_directory: str,
+        embedding_model_name: str,
+        max_converters: int = DOCLING_MAX_CONVERTERS,
+        warm_up_file: str | None = None
+) -> None:
+    global _worker_chunk, _worker_chunker
+    _worker_chunk = Chunk(source_directory, persist_directory, embedding_model_name, max_converters=max_converters)
+    _worker_chunker = _worker_chunk._get_chunker()
+    if warm_up_file:
+        _worker_chunk.warm_up(pathlib.Path(warm_up_file))
+
+
+def _ping_worker() -> None:
+    return None
+
+
+def _convert_range_in_worker(file_path: str, page_range: PageRange) -> list[Document]:
+    return _worker_chunk._convert_range(_worker_chunker, pathlib.Path(file_path), page_range)
+
+
 class Chunk:
-    def __init__(self, source_directory: str, persist_directory: str, embedding_model_name: str) -> None:
+    def __init__(
+            self,
+            source_directory: str,
+            persist_directory: str,
+            embedding_model_name: str,
+            max_converters: int = DOCLING_MAX_CONVERTERS
+    ) -> None:
         self.SOURCE_DIRECTORY = source_directory
         self.PERSIST_DIRECTORY = persist_directory
         self.EMBEDDING_MODEL_NAME = embedding_model_name
+        self.max_converters = max(1, max_converters)
+        self._converters: OrderedDict[tuple[bool, bool], DocumentConverter] = OrderedDict()
+        self._converters_lock = threading.Lock()
+        self._range_pool: ProcessPoolExecutor | None = None
+        self._range_pool_workers = 0
 
-    def _get_converter(self):
-        pipeline_options = PdfPipelineOptions()
-        pipeline_options.do_ocr = True
-        pipeline_options.do_table_structure = True
-        pipeline_options.ocr_options = RapidOcrOptions()
+    def _get_converter(self, ocr: bool = True, tables: bool = True):
+        key = (ocr, tables)
+        with self._converters_lock:
+            converter = self._converters.get(key)
+            if converter is not None:
+                self._converters.move_to_end(key)
+                return converter
 
-        return DocumentConverter(
-            format_options={
-                InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-            }
-        )
+            pipeline_options = PdfPipelineOptions()
+            pipeline_options.do_ocr = ocr
+            pipeline_options.do_table_structure = tables
+            if ocr:
+                pipeline_options.ocr_options = RapidOcrOptions()
 
-    def load_documents(self) -> list[Document] | None:
-        pdf_files = list(pathlib.Path(self.SOURCE_DIRECTORY).glob("*.pdf"))
-        if not pdf_files:
-            return None
+            converter = DocumentConverter(
+                format_options={
+                    InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+                }
+            )
+            self._converters[key] = converter
+            while len(self._converters) > self.max_converters:
+                self._converters.popitem(last=False)
+            return converter
 
-        all_elements: list[Document] = []
-        converter = self._get_converter()
+    def warm_up(self, file_path: pathlib.Path) -> None:
+        """Загружает модели профилей, которые поместятся в кэш конвертеров.
+
+        При пределе ниже числа профилей прогреваются самые тяжёлые (с таблицами и OCR),
+        а остальные загрузятся при первом обращении.
+        """
+        for ocr, tables in CONVERTER_PROFILES[-self.max_converters:]:
+            self._get_converter(ocr=ocr, tables=tables).convert(str(file_path), page_range=(1, 1))
+
+    def start_range_pool(self, workers: int, warm_up_file: pathlib.Path | None = None) -> ProcessPoolExecutor:
+        """Пул процессов для диапазонов одного файла; warm_up_file прогревает модели в каждом процессе."""
+        if self._range_pool is not None and self._range_pool_workers == workers:
+            return self._range_pool
+        self.close()
+        self._range_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_bulk_worker,
+            initargs=(
+                self.SOURCE_DIRECTORY,
+                self.PERSIST_DIRECTORY,
+                self.EMBEDDING_MODEL_NAME,
+                self.max_converters,
+                str(warm_up_file) if warm_up_file else None,
+            )
+        )
+        self._range_pool_workers = workers
+        # Процессы стартуют лениво; пустые задачи поднимают (и прогревают) все сразу
+        for future in [self._range_pool.submit(_ping_worker) for _ in range(workers)]:
+            future.result()
+        return self._range_pool
+
+    def close(self) -> None:
+        if self._range_pool is not None:
+            self._range_pool.shutdown()
+            self._range_pool = None
+            self._range_pool_workers = 0
 
-        chunker = HybridChunker(
-            tokenizer="sentence-transformers/all-MiniLM-L6-v2",
+    def _get_chunker(self):
+        return HybridChunker(
+            tokenizer=EMBEDDING_MODEL_NAME,
             max_tokens=450,
             merge_peers=True
         )
 
-        for file_path in pdf_files:
-            try:
-                print(f"Processing: {file_path.name}")
+    def _convert_range(self, chunker, file_path: pathlib.Path, page_range: PageRange) -> list[Document]:
+        converter = self._get_converter(ocr=page_range.ocr, tables=page_range.tables)
+        result = converter.convert(str(file_path), page_range=(page_range.start, page_range.end))
+        doc_obj = result.document
 
-                result = converter.convert(str(file_path))
-                doc_obj = result.document
+        elements: list[Document] = []
+        chunk_iter = chunker.chunk(doc_obj)
 
-                chunk_iter = chunker.chunk(doc_obj)
+        for i, chunk in enumerate(chunk_iter):
+            text_content = normalize_formulas(chunk.text)
 
-                for i, chunk in enumerate(chunk_iter):
-                    text_content = normalize_formulas(chunk.text)
+            headings_list = []
+            if chunk.meta.headings:
+                for h in chunk.meta.headings:
+                    if isinstance(h, str):
+                        headings_list.append(h)
+                    elif hasattr(h, 'text'):
+                        headings_list.append(h.text)
+                    else:
+                        headings_list.append(str(h))
 
-                    headings_list = []
-                    if chunk.meta.headings:
-                        for h in chunk.meta.headings:
-                            if isinstance(h, str):
-                                headings_list.append(h)
-                            elif hasattr(h, 'text'):
-                                headings_list.append(h.text)
-                            else:
-                                headings_list.append(str(h))
+            headings_str = " > ".join(headings_list)
+
+            metadata = {
+                "source": str(file_path),
+                "filename": file_path.name,
+                "page": list(chunk.meta.doc_items)[0].prov[0].page_no if chunk.meta.doc_items else page_range.start,
+                "headings": headings_str,
+                "chunk_index": i
+            }
 
-                    headings_str = " > ".join(headings_list)
+            lc_doc = Document(
+                page_content=text_content,
+                metadata=metadata
+            )
+            elements.append(lc_doc)
+
+        return elements
+
+    def _file_to_documents(
+            self,
+            chunker,
+            file_path: pathlib.Path,
+            workers: int = 1,
+            prepass: bool = DOCLING_PREPASS
+    ) -> tuple[list[Document], list[PageRange]]:
+        """Возвращает чанки и диапазоны страниц, по которым шла конвертация."""
+        ranges = plan_page_ranges(file_path, prepass=prepass)
+        if workers > 1 and len(ranges) > 1:
+            # Конвертер docling не рассчитан на вызовы из нескольких потоков, поэтому диапазоны - по процессам
+            pool = self.start_range_pool(workers)
+            parts = list(pool.map(_convert_range_in_worker, [str(file_path)] * len(ranges), ranges))
+        else:
+            # Диапазоны одного профиля подряд, чтобы ограниченный кэш не перезагружал модели
+            order = sorted(range(len(ranges)), key=lambda i: (ranges[i].ocr, ranges[i].tables))
+            converted = {i: self._convert_range(chunker, file_path, ranges[i]) for i in order}
+            parts = [converted[i] for i in range(len(ranges))]
+        return merge_ranges(parts), ranges
+
+    def load_documents(self) -> list[Document] | None:
+        pdf_files = list(pathlib.Path(self.SOURCE_DIRECTORY).glob("*.pdf"))
+        if not pdf_files:
+            return None
 
-                    metadata = {
-                        "source": str(file_path),
-                        "filename": file_path.name,
-                        "page": list(chunk.meta.doc_items)[0].prov[0].page_no if chunk.meta.doc_items else 1,
-                        "headings": headings_str,
-                        "chunk_index": i
-                    }
+        all_elements: list[Document] = []
+        chunker = self._get_chunker()
 
-                    lc_doc = Document(
-                        page_content=text_content,
-                        metadata=metadata
-                    )
-                    all_elements.append(lc_doc)
+        for file_path in pdf_files:
+            try:
+                print(f"Processing: {file_path.name}")
+                elements, _ = self._file_to_documents(chunker, file_path)
+                all_elements.extend(elements)
 
             except Exception as e:
                 print(f"Error processing {file_path}: {e}")
@@ -103,4 +319,138 @@ class Chunk:
 
         filtered = [chunk for chunk in chunks if len(chunk.page_content) > 30]
 
-        return filter_complex_metadata(filtered)
\ No newline at end of file
+        return filter_complex_metadata(filtered)
+
+    def iter_chunks(self, documents):
+        for doc in documents:
+            if len(doc.page_content) > 30:
+                yield from filter_complex_metadata([doc])
+
+    def _load_checkpoint(self, checkpoint_path: str) -> set[str]:
+        if not os.path.exists(checkpoint_path):
+            return set()
+        with open(checkpoint_path) as f:
+            return set(json.load(f).get("done", []))
+
+    def _save_checkpoint(self, checkpoint_path: str, done: set[str]) -> None:
+        tmp_path = checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"done": sorted(done)}, f)
+        os.replace(tmp_path, checkpoint_path)
+
+    def _iter_converted(self, pdf_files: list[pathlib.Path], workers: int, prepass: bool = DOCLING_PREPASS):
+        """Диапазоны страниц всех файлов конвертируются параллельно, файлы отдаются по порядку."""
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_bulk_worker,
+                initargs=(self.SOURCE_DIRECTORY, self.PERSIST_DIRECTORY, self.EMBEDDING_MODEL_NAME, self.max_converters)
+        ) as pool:
+            in_flight = deque()
+            submitted_ranges = 0
+            files = iter(pdf_files)
+
+            def submit_next() -> bool:
+                nonlocal submitted_ranges
+                file_path = next(files, None)
+                if file_path is None:
+                    return False
+                try:
+                    ranges = plan_page_ranges(file_path, prepass=prepass)
+                except Exception as e:
+                    print(f"Error processing {file_path}: {e}")
+                    return True
+                futures = [pool.submit(_convert_range_in_worker, str(file_path), r) for r in ranges]
+                in_flight.append((file_path, ranges, futures))
+                submitted_ranges += len(ranges)
+                return True
+
+            while submitted_ranges < workers * 2 and submit_next():
+                pass
+
+            while in_flight:
+                file_path, ranges, futures = in_flight.popleft()
+                submitted_ranges -= len(ranges)
+                while submitted_ranges < workers * 2 and submit_next():
+                    pass
+                try:
+                    parts = [future.result() for future in futures]
+                except Exception as e:
+                    print(f"Error processing {file_path}: {e}")
+                    continue
+                yield str(file_path), merge_ranges(parts), {
+                    "pages": sum(r.pages for r in ranges),
+                    "ocr_pages": sum(r.pages for r in ranges if r.ocr),
+                    "table_pages": sum(r.pages for r in ranges if r.tables),
+                }
+
+    def build_corpus(
+            self,
+            workers: int | None = None,
+            checkpoint_path: str | None = None,
+            prepass: bool = DOCLING_PREPASS
+    ) -> dict:
+        from db.embedders import create_cached_embeddings
+        from db.populate_db import file_sha256, stable_chunk_ids, sync_document
+
+        workers = workers or os.cpu_count() or 1
+        checkpoint_path = checkpoint_path or os.path.join(self.PERSIST_DIRECTORY, "bulk_build_checkpoint.json")
+
+        done = self._load_checkpoint(checkpoint_path)
+        pdf_files = [p for p in sorted(pathlib.Path(self.SOURCE_DIRECTORY).glob("*.pdf")) if p.name not in done]
+        print(f"Файлов к обработке: {len(pdf_files)} (уже готово: {len(done)})")
+
+        # Тот же кэш (или сервер эмбеддингов), что у воркеров и populate_db
+        embeddings = create_cached_embeddings(model_name=self.EMBEDDING_MODEL_NAME)
+
+        stats = {
+            "files": 0, "pages": 0, "ocr_pages": 0, "table_pages": 0, "chunks": 0,
+            "added": 0, "updated": 0, "deleted": 0, "prepass": prepass,
+        }
+        started = time.perf_counter()
+        processed_sources: list[str] = []
+
+        for file_path, documents, page_stats in self._iter_converted(pdf_files, workers, prepass=prepass):
+            path = pathlib.Path(file_path)
+            chunks = list(self.iter_chunks(documents))
+            doc_hash = file_sha256(file_path)
+
+            # Тот же путь записи, что у онлайн-загрузки: без повторного эмбеддинга известных чанков,
+            # с удалением осиротевших, лексическим индексом и картой соседей
+            synced = sync_document(
+                doc_hash,
+                chunks,
+                stable_chunk_ids(doc_hash, chunks),
+                persist_directory=self.PERSIST_DIRECTORY,
+                embedder=embeddings
+            )
+            processed_sources.append(file_path)
+            done.add(path.name)
+            self._save_checkpoint(checkpoint_path, done)
+
+            stats["files"] += 1
+            for key, value in page_stats.items():
+                stats[key] += value
+            for key, value in synced.items():
+                stats[key] += value
+            stats["chunks"] += len(chunks)
+
+            elapsed = time.perf_counter() - started
+            print(
+                f"[{stats['files']}/{len(pdf_files)}] {path.name}: "
+                f"{stats['pages'] / elapsed:.2f} pages/s, {stats['chunks'] / elapsed:.2f} chunks/s"
+            )
+
+        if processed_sources:
+            # Кэш ответов забудет пересобранные файлы
+            try:
+                from source.services.answer_cache import invalidate_sources
+                invalidate_sources(processed_sources)
+            except Exception as e:
+                print(f"Не удалось инвалидировать кэш ответов: {e}")
+
+        elapsed = time.perf_counter() - started
+        stats["seconds"] = elapsed
+        stats["pages_per_second"] = stats["pages"] / elapsed if elapsed else 0.0
+        stats["chunks_per_second"] = stats["chunks"] / elapsed if elapsed else 0.0
+        print(f"Сборка корпуса завершена: {stats}")
+        return stats
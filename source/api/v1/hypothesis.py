@@ -1,11 +1,24 @@
-from celery.result import AsyncResult
-from fastapi import APIRouter, HTTPException, status
+import json
+import time
+from uuid import uuid4
 
-from source.schemas.request import HypothesisRequest
-from source.services.llm import get_llm_response
+from celery import states
+from celery.result import AsyncResult
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
-from source.services.celery_app import celery_app
+from source.schemas.request import HypothesisRequest, HypothesisBatchRequest
+from source.services.celery_app import celery_app, STREAM_CHANNEL
+from source.services.answer_cache import answer_cache
+from source.services.llm_client import LLMError
+from source.services.llm_router import get_llm_router
+from source.services.metrics import span
+from source.services.task_waiter import get_async_redis, wait_for_task
 
+STREAM_IDLE_TIMEOUT = 120
+MAX_WAIT = 60
+WS_WAIT_SLICE = 30
 
 
 router = APIRouter(prefix="/hypothesis", tags=["hypothesis"])
@@ -17,7 +30,7 @@ router = APIRouter(prefix="/hypothesis", tags=["hypothesis"])
 )
 async def generate_hypothesis(hypothesis: HypothesisRequest):
     try:
-        task = get_llm_response.delay(hypothesis.text)
+        task = celery_app.send_task("source.services.llm.get_llm_response", args=[hypothesis.text])
         return {"task_id": task.id}
     except Exception as e:
         raise HTTPException(
@@ -25,23 +38,195 @@ async def generate_hypothesis(hypothesis: HypothesisRequest):
             detail=f"Не удалось сгенирировать гипотезу, произошла ошибка: {e}")
 
 
+@router.post(
+    path="/batch",
+    summary="Сгенерировать гипотезы для списка запросов",
+    status_code=status.HTTP_200_OK
+)
+async def generate_hypothesis_batch(batch: HypothesisBatchRequest):
+    try:
+        task = celery_app.send_task("source.services.llm.get_llm_response_batch", args=[batch.texts])
+        return {"group_id": task.id}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Не удалось сгенирировать гипотезы, произошла ошибка: {e}")
+
+
+@router.get(
+    "/batch/{group_id}",
+    summary="Получить статус пакетной генерации по каждому запросу",
+    status_code=status.HTTP_200_OK
+)
+async def get_batch_result(group_id: str, wait: float = Query(0, ge=0, le=MAX_WAIT)):
+    try:
+        if wait:
+            await wait_for_task(group_id, wait)
+        return await run_in_threadpool(_batch_response, group_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Не удалось получить статус, произошла ошибка: {e}")
+
+
+def _batch_response(group_id: str) -> dict:
+    task_result = AsyncResult(group_id, app=celery_app)
+    state = task_result.state
+    if state in ("PROGRESS", "SUCCESS") and isinstance(task_result.info, dict):
+        return {"status": state, "items": task_result.info.get("items", [])}
+    return {"status": state}
+
+
+@router.post(
+    path="/direct",
+    summary="Сгенерировать гипотезу, обращаясь к LLM прямо из API",
+    status_code=status.HTTP_200_OK
+)
+async def generate_hypothesis_direct(hypothesis: HypothesisRequest):
+    # Поиск и промпт собирает воркер, чтобы API не загружал модель эмбеддингов;
+    # сам запрос к LLM идёт из API через роутер, не занимая LLM-воркер на время генерации
+    try:
+        task = celery_app.send_task("source.services.llm.build_llm_prompt", args=[hypothesis.text])
+        state = await wait_for_task(task.id, MAX_WAIT)
+        built = await run_in_threadpool(_prompt_result, task.id, state)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Не удалось собрать промпт, произошла ошибка: {e}")
+
+    try:
+        response = await run_in_threadpool(_direct_answer, built)
+    except LLMError as e:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=e.to_dict())
+    return {"status": "SUCCESS", **response}
+
+
+def _direct_answer(built: dict) -> dict:
+    cached = answer_cache.get(built["query_vector"], built["fingerprint"])
+    if cached is not None:
+        return {"answer": cached, "cached": True, "model": None}
+
+    with span("llm_request_seconds", mode="complete", model="none") as labels:
+        content, model = get_llm_router().complete(built["prompt"])
+        labels["model"] = model
+
+    answer_cache.put(built["query_vector"], built["fingerprint"], content, set(built["sources"]))
+    return {"answer": content, "cached": False, "model": model}
+
+
+def _prompt_result(task_id: str, state: str) -> dict:
+    task_result = AsyncResult(task_id, app=celery_app)
+    if state != states.SUCCESS:
+        if state not in states.READY_STATES:
+            task_result.revoke()
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Промпт не собран за отведённое время")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Не удалось собрать промпт: {task_result.result}")
+    built = task_result.result
+    task_result.forget()
+    return built
+
+
+@router.post(
+    path="/stream",
+    summary="Сгенерировать гипотезу с потоковой выдачей токенов (SSE)",
+    status_code=status.HTTP_200_OK
+)
+async def stream_hypothesis(hypothesis: HypothesisRequest):
+    task_id = str(uuid4())
+    pubsub = get_async_redis().pubsub()
+    try:
+        await pubsub.subscribe(STREAM_CHANNEL.format(task_id=task_id))
+        celery_app.send_task("source.services.llm.stream_llm_response", args=[hypothesis.text], task_id=task_id)
+    except Exception as e:
+        await pubsub.aclose()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Не удалось сгенирировать гипотезу, произошла ошибка: {e}")
+
+    async def events():
+        yield f"event: task\ndata: {json.dumps({'task_id': task_id})}\n\n"
+        deadline = time.monotonic() + STREAM_IDLE_TIMEOUT
+        try:
+            while time.monotonic() < deadline:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                data = message["data"]
+                if isinstance(data, bytes):
+                    data = data.decode("utf-8")
+                event = json.loads(data)
+                yield f"event: {event['type']}\ndata: {data}\n\n"
+                if event["type"] in ("done", "error"):
+                    return
+                deadline = time.monotonic() + STREAM_IDLE_TIMEOUT
+            yield f"event: error\ndata: {json.dumps({'type': 'error', 'detail': 'timeout'})}\n\n"
+        finally:
+            await pubsub.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @router.get(
     "/{task_id}",
     summary="Получить результат выполнения задачи",
     status_code=status.HTTP_200_OK
 )
-async def get_task_result(task_id: str):
+async def get_task_result(task_id: str, wait: float = Query(0, ge=0, le=MAX_WAIT)):
     try:
-        task_result = AsyncResult(task_id, app=celery_app)
-        if task_result.state == "SUCCESS":
-            response = task_result.result
-            if not response:
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="Не удалось сгенирировать гипотезу")
-            return {"status": "SUCCESS", "answer": response}
-        return  {"status": task_result.state}
+        if wait:
+            await wait_for_task(task_id, wait)
+        return await run_in_threadpool(_task_response, task_id)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Не удалось сгенирировать гипотезу, произошла ошибка: {e}")
+
+
+@router.websocket("/ws/{task_id}")
+async def task_result_ws(websocket: WebSocket, task_id: str):
+    await websocket.accept()
+    try:
+        while True:
+            state = await wait_for_task(task_id, WS_WAIT_SLICE)
+            if state in states.READY_STATES:
+                break
+            await websocket.send_json({"status": state})
+
+        try:
+            response = await run_in_threadpool(_task_response, task_id)
+        except HTTPException as e:
+            response = {"status": "FAILURE", "detail": e.detail}
+        await websocket.send_json(response)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
+def _task_response(task_id: str) -> dict:
+    task_result = AsyncResult(task_id, app=celery_app)
+    if task_result.state == "SUCCESS":
+        response = task_result.result
+        cached = False
+        model = None
+        if isinstance(response, dict):
+            if response.get("error"):
+                raise HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY,
+                    detail=response["error"])
+            cached = response.get("cached", False)
+            model = response.get("model")
+            response = response.get("answer")
+        if not response:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Не удалось сгенирировать гипотезу")
+        return {"status": "SUCCESS", "answer": response, "cached": cached, "model": model}
+    return  {"status": task_result.state}
@@ -1,9 +1,8 @@
 from fastapi import APIRouter, status, HTTPException
+from fastapi.concurrency import run_in_threadpool
 
 from source.schemas.request import ArticleDownload
-from source.services.downloader import Downloader
-
-from db.populate_db import add_single_document_to_db
+from source.services.ingest_jobs import start_ingest, get_job
 
 
 router = APIRouter(prefix="/article", tags=["articles"])
@@ -11,17 +10,26 @@ router = APIRouter(prefix="/article", tags=["articles"])
 @router.post(
     "/",
     summary="Добавить статью по ссылке в базу данных",
-    status_code=status.HTTP_200_OK
+    status_code=status.HTTP_202_ACCEPTED
 )
 async def download_article(data: ArticleDownload) -> dict:
-    downloader = Downloader()
     try:
-        success = downloader.process(str(data.url))
-        if not success:
-            raise HTTPException(status_code=404, detail="Не удалось найти PDF по этой ссылке")
+        job_id = await run_in_threadpool(start_ingest, str(data.url))
+        return {"job_id": job_id}
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="При скачивании статьи произошла ошибка")
 
-        add_single_document_to_db("../data_sources/scraped_article.pdf")
 
-        return {"status": "SUCCESS"}
+@router.get(
+    "/{job_id}",
+    summary="Получить статус загрузки статьи по стадиям",
+    status_code=status.HTTP_200_OK
+)
+async def get_article_status(job_id: str) -> dict:
+    try:
+        job = await run_in_threadpool(get_job, job_id)
     except Exception:
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="При скачивании статьи произошла ошибка")
\ No newline at end of file
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Не удалось получить статус загрузки")
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Задача не найдена")
+    return job
@@ -1,8 +1,25 @@
+import os
+import time
 import uvicorn
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
 from source.api.v1.ingest import router as ingest_router
 from source.api.v1.hypothesis import router as hypothesis_router
-from db.populate_db import lifespan
+from source.services.celery_app import WARM_RETRIEVERS_KEY
+from source.services.llm_client import close_llm_clients
+from source.services.metrics import render as render_metrics
+from source.services.task_waiter import close_async_redis, get_async_redis
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        yield
+    finally:
+        await close_llm_clients()
+        await close_async_redis()
 
 
 # TODO: асинхронная обработка задач через celery
@@ -11,9 +28,47 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILES_DIR = os.getenv("PROFILES_DIR", "../profiles")
+
 app.include_router(ingest_router, prefix="/api/v1")
 app.include_router(hypothesis_router, prefix="/api/v1")
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(await run_in_threadpool(render_metrics), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health/retriever", include_in_schema=False)
+async def retriever_health():
+    """Готовность поиска: 503, пока ни один воркер не прогрел ретривер."""
+    states = await get_async_redis().hgetall(WARM_RETRIEVERS_KEY)
+    warm = sum(1 for value in states.values() if value in (b"1", "1"))
+    return JSONResponse({"warm": warm, "cold": len(states) - warm}, status_code=200 if warm else 503)
+
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    if not PROFILING_ENABLED or request.headers.get("X-Profile") != "1":
+        return await call_next(request)
+
+    from pyinstrument import Profiler
+
+    profiler = Profiler(async_mode="enabled")
+    profiler.start()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    path = os.path.join(PROFILES_DIR, f"{int(time.time() * 1000)}_{request.url.path.strip('/').replace('/', '_')}.html")
+    with open(path, "w") as f:
+        f.write(profiler.output_html())
+    response.headers["X-Profile-Path"] = path
+    return response
+
+
 if __name__ == "__main__":
     uvicorn.run(app)
\ No newline at end of file
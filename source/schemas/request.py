@@ -1,8 +1,11 @@
-from pydantic import HttpUrl, BaseModel
+from pydantic import HttpUrl, BaseModel, Field
 
 
 class ArticleDownload(BaseModel):
     url: HttpUrl
 
 class HypothesisRequest(BaseModel):
-    text: str
\ No newline at end of file
+    text: str
+
+class HypothesisBatchRequest(BaseModel):
+    texts: list[str] = Field(min_length=1, max_length=100)
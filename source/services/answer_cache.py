@@ -0,0 +1,143 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from langchain_core.documents import Document
+
+from source.services.celery_app import get_redis
+
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+INVALIDATION_KEY = "answer_cache:invalidated:{source}"
+
+
+def context_fingerprint(documents: list[Document]) -> str:
+    chunk_ids = sorted(
+        doc.id or f"{doc.metadata.get('source')}:{doc.metadata.get('chunk_index', doc.metadata.get('page'))}"
+        for doc in documents
+    )
+    return hashlib.sha256("\n".join(chunk_ids).encode("utf-8")).hexdigest()
+
+
+def cited_sources(documents: list[Document]) -> set[str]:
+    return {str(doc.metadata["source"]) for doc in documents if doc.metadata.get("source") is not None}
+
+
+def _cosine(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _redis():
+    try:
+        return get_redis()
+    except Exception:
+        return None
+
+
+def invalidate_sources(sources) -> None:
+    client = _redis()
+    if client is None:
+        return
+    now = time.time()
+    try:
+        for source in sources:
+            client.set(INVALIDATION_KEY.format(source=source), now, ex=ANSWER_CACHE_TTL)
+    except Exception as e:
+        print(f"Не удалось инвалидировать кэш ответов: {e}")
+
+
+def _invalidated_after(sources: set[str], created_at: float) -> bool:
+    client = _redis()
+    if client is None or not sources:
+        return False
+    try:
+        values = client.mget([INVALIDATION_KEY.format(source=source) for source in sources])
+    except Exception:
+        return False
+    return any(value is not None and float(value) >= created_at for value in values)
+
+
+@dataclass
+class CachedAnswer:
+    query_vector: list[float]
+    answer: str
+    sources: set[str] = field(default_factory=set)
+    created_at: float = field(default_factory=time.time)
+
+
+class AnswerCache:
+    def __init__(
+            self,
+            threshold: float = ANSWER_CACHE_THRESHOLD,
+            ttl: int = ANSWER_CACHE_TTL,
+            max_items: int = ANSWER_CACHE_SIZE
+    ) -> None:
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+
+        self._entries: OrderedDict[tuple[str, int], CachedAnswer] = OrderedDict()
+        self._by_fingerprint: dict[str, list[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _remove(self, key: tuple[str, int]) -> None:
+        # Два параллельных get могут выбрать одну запись и оба прийти её удалять
+        if self._entries.pop(key, None) is None:
+            return
+        fingerprint, entry_id = key
+        ids = self._by_fingerprint.get(fingerprint)
+        if ids is not None:
+            ids.remove(entry_id)
+            if not ids:
+                del self._by_fingerprint[fingerprint]
+
+    def get(self, query_vector: list[float], fingerprint: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for entry_id in list(self._by_fingerprint.get(fingerprint, [])):
+                key = (fingerprint, entry_id)
+                entry = self._entries[key]
+                if now - entry.created_at > self.ttl:
+                    self._remove(key)
+                    continue
+                score = _cosine(query_vector, entry.query_vector)
+                if score >= best_score:
+                    best_key, best_score = key, score
+
+            if best_key is None:
+                return None
+            entry = self._entries[best_key]
+
+        if _invalidated_after(entry.sources, entry.created_at):
+            with self._lock:
+                self._remove(best_key)
+            return None
+
+        with self._lock:
+            if best_key in self._entries:
+                self._entries.move_to_end(best_key)
+        return entry.answer
+
+    def put(self, query_vector: list[float], fingerprint: str, answer: str, sources: set[str]) -> None:
+        with self._lock:
+            key = (fingerprint, self._next_id)
+            self._next_id += 1
+            self._entries[key] = CachedAnswer(query_vector=query_vector, answer=answer, sources=sources)
+            self._by_fingerprint.setdefault(fingerprint, []).append(key[1])
+            while len(self._entries) > self.max_items:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,157 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from fake_useragent import UserAgent
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+BROWSER_MAX_USES = int(os.getenv("BROWSER_MAX_USES", "20"))
+BROWSER_WORKER = os.getenv("BROWSER_WORKER", "0") == "1"
+
+_driver_path: str | None = None
+_driver_path_lock = threading.Lock()
+
+
+def get_driver_path() -> str:
+    global _driver_path
+    if _driver_path is None:
+        with _driver_path_lock:
+            if _driver_path is None:
+                _driver_path = ChromeDriverManager().install()
+    return _driver_path
+
+
+class BrowserSession:
+    def __init__(self, user_agent: str) -> None:
+        chrome_options = Options()
+        chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument(f"user-agent={user_agent}")
+        chrome_options.add_argument("--disable-blink-features=AutomationControlled")
+
+        self.driver = webdriver.Chrome(service=Service(get_driver_path()), options=chrome_options)
+        self.uses = 0
+        self.broken = False
+
+    def _visited_origins(self) -> set[str]:
+        """Источники, которые могли оставить хранилище: история вкладки и домены кук (в т.ч. iframe)."""
+        origins = set()
+        history = self.driver.execute_cdp_cmd("Page.getNavigationHistory", {})
+        for entry in history.get("entries", []):
+            parts = urlsplit(entry.get("url", ""))
+            if parts.scheme in ("http", "https") and parts.netloc:
+                origins.add(f"{parts.scheme}://{parts.netloc}")
+        for cookie in self.driver.execute_cdp_cmd("Network.getAllCookies", {}).get("cookies", []):
+            domain = cookie.get("domain", "").lstrip(".")
+            if domain:
+                origins.update({f"https://{domain}", f"http://{domain}"})
+        return origins
+
+    def reset(self) -> None:
+        # Куки чистятся целиком, а localStorage/IndexedDB - только по конкретным источникам:
+        # Storage.clearDataForOrigin не понимает "*", поэтому собираем источники этой аренды
+        origins = self._visited_origins()
+        self.driver.get("about:blank")
+        self.driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        self.driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+        for origin in origins:
+            self.driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+        self.driver.execute_cdp_cmd("Page.resetNavigationHistory", {})
+
+    def quit(self) -> None:
+        try:
+            self.driver.quit()
+        except Exception as e:
+            print(f"Ошибка при закрытии браузера: {e}")
+
+
+class BrowserPool:
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_uses: int = BROWSER_MAX_USES) -> None:
+        self.size = size
+        self.max_uses = max_uses
+        self.ua = UserAgent()
+
+        self._idle: queue.LifoQueue[BrowserSession] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def _acquire(self) -> BrowserSession:
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return BrowserSession(self.ua.random)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, session: BrowserSession) -> None:
+        try:
+            session.uses += 1
+            if self._closed or session.broken or session.uses >= self.max_uses:
+                session.quit()
+                return
+            try:
+                session.reset()
+            except Exception as e:
+                print(f"Браузер не отвечает, пересоздаю: {e}")
+                session.quit()
+                return
+            self._idle.put(session)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def session(self):
+        session = self._acquire()
+        try:
+            yield session.driver
+        except Exception:
+            session.broken = True
+            raise
+        finally:
+            self._release(session)
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().quit()
+            except queue.Empty:
+                break
+
+
+_pool: BrowserPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = BrowserPool()
+    return _pool
+
+
+def init_browser_pool() -> None:
+    get_driver_path()
+    get_browser_pool()
+
+
+def close_browser_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -1,9 +1,165 @@
+import os
+import socket
+import time
+
 from celery import Celery
+from kombu import Queue
+from celery.signals import (
+    before_task_publish,
+    celeryd_after_setup,
+    task_postrun,
+    task_prerun,
+    worker_process_init,
+    worker_process_shutdown,
+)
+
+from source.services.metrics import inc, observe
+
 
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STREAM_CHANNEL = "hypothesis:stream:{task_id}"
+RESULT_EXPIRES = int(os.getenv("CELERY_RESULT_EXPIRES", "3600"))
+# "auto" - ретривер грузят только воркеры очередей с поиском по базе, "1"/"0" - всегда/никогда
+RETRIEVER_WORKER = os.getenv("RETRIEVER_WORKER", "auto")
+WARM_RETRIEVERS_KEY = "retriever:warm"
 
 celery_app = Celery(
     'articles',
-    broker='redis://localhost:6379/0',
-    backend='redis://localhost:6379/0',
-    include=['source.services.llm']
-)
\ No newline at end of file
+    broker=REDIS_URL,
+    backend=REDIS_URL,
+    include=['source.services.llm', 'source.services.ingest_pipeline']
+)
+
+celery_app.conf.result_expires = RESULT_EXPIRES
+
+# У каждого вида работы своя очередь, чтобы LLM, браузерные и parse/embed воркеры
+# масштабировались независимо: celery worker -Q llm.interactive
+# Интерактивные запросы и пакетная генерация идут разными полосами; воркер,
+# слушающий обе, выбирает их по кругу, поэтому под полосы лучше держать отдельные воркеры.
+# Сборка промпта для /hypothesis/direct не ждёт лимитер и не должна стоять за LLM-задачами,
+# поэтому у неё своя очередь и свой воркер: celery worker -Q prompt
+TASK_QUEUES = [
+    'default',
+    'prompt',
+    'llm.interactive',
+    'llm.bulk',
+    'ingest.resolve',
+    'ingest.download',
+    'ingest.parse',
+    'ingest.upsert',
+    'embed',
+]
+
+celery_app.conf.task_default_queue = 'default'
+celery_app.conf.task_queues = [Queue(name) for name in TASK_QUEUES]
+
+# Внутри очереди Redis-брокер учитывает приоритет: 0 - самый срочный
+celery_app.conf.broker_transport_options = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+celery_app.conf.task_default_priority = 5
+
+# LLM-задачи долгие и ждут лимитер, поэтому воркер не набирает их впрок
+celery_app.conf.worker_prefetch_multiplier = 1
+
+celery_app.conf.task_routes = {
+    'source.services.llm.get_llm_response': {'queue': 'llm.interactive', 'priority': 0},
+    'source.services.llm.stream_llm_response': {'queue': 'llm.interactive', 'priority': 0},
+    'source.services.llm.build_llm_prompt': {'queue': 'prompt', 'priority': 0},
+    'source.services.llm.get_llm_response_batch': {'queue': 'llm.bulk', 'priority': 9},
+    'source.services.ingest_pipeline.resolve_article': {'queue': 'ingest.resolve'},
+    'source.services.ingest_pipeline.download_article': {'queue': 'ingest.download'},
+    'source.services.ingest_pipeline.parse_article': {'queue': 'ingest.parse'},
+    'source.services.ingest_pipeline.embed_article': {'queue': 'embed'},
+    'source.services.ingest_pipeline.upsert_article': {'queue': 'ingest.upsert'},
+}
+
+
+def get_redis():
+    return celery_app.backend.client
+
+
+# Задачи этих очередей ищут по базе; ingest- и браузерным воркерам модель и Chroma не нужны
+RETRIEVAL_QUEUES = {'prompt', 'llm.interactive', 'llm.bulk'}
+
+_consumed_queues: set[str] | None = None
+
+
+@celeryd_after_setup.connect
+def on_worker_setup(sender=None, instance=None, **kwargs):
+    global _consumed_queues
+    # Вызывается в главном процессе до форка, дочерние процессы наследуют значение
+    _consumed_queues = set(instance.app.amqp.queues.consume_from)
+
+
+def _serves_retrieval() -> bool:
+    if RETRIEVER_WORKER != "auto":
+        return RETRIEVER_WORKER == "1"
+    return _consumed_queues is None or bool(_consumed_queues & RETRIEVAL_QUEUES)
+
+
+def _retriever_field() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _publish_retriever_state(warm: bool | None) -> None:
+    """Состояние ретривера процесса для /health/retriever: None снимает запись."""
+    try:
+        if warm is None:
+            get_redis().hdel(WARM_RETRIEVERS_KEY, _retriever_field())
+        else:
+            get_redis().hset(WARM_RETRIEVERS_KEY, _retriever_field(), 1 if warm else 0)
+    except Exception as e:
+        print(f"Не удалось записать состояние ретривера: {e}")
+
+
+@worker_process_init.connect
+def on_worker_process_init(**kwargs):
+    from db.retriever import init_retriever, is_retriever_warm
+    from source.services.browser_pool import BROWSER_WORKER, init_browser_pool
+
+    if _serves_retrieval():
+        init_retriever()
+        _publish_retriever_state(is_retriever_warm())
+    if BROWSER_WORKER:
+        init_browser_pool()
+
+
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(**kwargs):
+    from db.retriever import close_retriever
+    from source.services.browser_pool import close_browser_pool
+    from source.services.llm_client import close_llm_client
+
+    if _serves_retrieval():
+        _publish_retriever_state(None)
+    close_retriever()
+    close_llm_client()
+    close_browser_pool()
+
+
+_task_started: dict[str, float] = {}
+
+
+@before_task_publish.connect
+def on_before_task_publish(headers=None, **kwargs):
+    if headers is not None:
+        headers["sent_at"] = time.time()
+
+
+@task_prerun.connect
+def on_task_prerun(task_id=None, task=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+    sent_at = getattr(task.request, "sent_at", None) or (task.request.headers or {}).get("sent_at")
+    if sent_at:
+        observe("celery_queue_wait_seconds", max(0.0, time.time() - float(sent_at)), task=task.name)
+
+
+@task_postrun.connect
+def on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        observe("celery_task_runtime_seconds", time.perf_counter() - started, task=task.name)
+    inc("celery_tasks_total", task=task.name, state=state or "UNKNOWN")
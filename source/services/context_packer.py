@@ -0,0 +1,163 @@
+import os
+from dataclasses import dataclass, field
+
+from langchain_core.documents import Document
+
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "cl100k_base")
+
+MIN_OVERLAP = 20
+MAX_OVERLAP = 600
+MIN_TRUNCATED_TOKENS = 64
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(CONTEXT_TOKENIZER)
+        except Exception as e:
+            print(f"Токенизатор {CONTEXT_TOKENIZER} недоступен, считаю токены приблизительно: {e}")
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    encoding = _get_encoding()
+    if encoding:
+        return encoding.decode(encoding.encode(text)[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def _overlap(left: str, right: str) -> int:
+    limit = min(len(left), len(right), MAX_OVERLAP)
+    for size in range(limit, MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+@dataclass
+class Passage:
+    source: str
+    label_name: str
+    text: str
+    pages: list = field(default_factory=list)
+    rank: float = float("inf")
+    last_index: int | None = None
+
+    @property
+    def label(self) -> str:
+        pages = ", ".join(str(p) for p in dict.fromkeys(self.pages))
+        if pages:
+            return f"[Источник: {self.label_name}, стр. {pages}]"
+        return f"[Источник: {self.label_name}]"
+
+    def render(self, text: str | None = None) -> str:
+        return f"{self.label}\n{text if text is not None else self.text}"
+
+
+def _label_name(meta: dict) -> str:
+    name = meta.get("filename") or meta.get("source_filename") or meta.get("source") or "неизвестно"
+    return os.path.basename(str(name))
+
+
+def _page(meta: dict):
+    return meta.get("page_number", meta.get("page"))
+
+
+def _nearest_rank(doc: Document, ranked: list[tuple[str, int, int]]) -> float:
+    meta = doc.metadata
+    if meta.get("retrieval_rank") is not None:
+        return float(meta["retrieval_rank"])
+    idx = meta.get("chunk_index")
+    if idx is None:
+        return float("inf")
+    best = float("inf")
+    for source, hit_index, hit_rank in ranked:
+        if source == meta.get("source"):
+            best = min(best, hit_rank + abs(int(idx) - hit_index) * 0.5)
+    return best
+
+
+def merge_passages(documents: list[Document]) -> list[Passage]:
+    ranked = [
+        (d.metadata.get("source"), int(d.metadata["chunk_index"]), int(d.metadata["retrieval_rank"]))
+        for d in documents
+        if d.metadata.get("retrieval_rank") is not None and d.metadata.get("chunk_index") is not None
+    ]
+
+    def order(doc: Document):
+        meta = doc.metadata
+        return (str(meta.get("source", "")), int(meta.get("chunk_index", 0) or 0))
+
+    passages: list[Passage] = []
+    seen_texts: set[str] = set()
+    for doc in sorted(documents, key=order):
+        text = doc.page_content.strip()
+        if not text or text in seen_texts:
+            continue
+        seen_texts.add(text)
+
+        meta = doc.metadata
+        idx = meta.get("chunk_index")
+        idx = int(idx) if idx is not None else None
+        rank = _nearest_rank(doc, ranked)
+
+        current = passages[-1] if passages else None
+        if (
+                current is not None
+                and current.source == meta.get("source")
+                and idx is not None
+                and current.last_index is not None
+                and idx == current.last_index + 1
+        ):
+            overlap = _overlap(current.text, text)
+            current.text += text[overlap:] if overlap else "\n" + text
+            current.last_index = idx
+            current.rank = min(current.rank, rank)
+            if _page(meta) is not None:
+                current.pages.append(_page(meta))
+            continue
+
+        passages.append(Passage(
+            source=meta.get("source"),
+            label_name=_label_name(meta),
+            text=text,
+            pages=[_page(meta)] if _page(meta) is not None else [],
+            rank=rank,
+            last_index=idx,
+        ))
+    return passages
+
+
+def pack_context(documents: list[Document], budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    passages = sorted(merge_passages(documents), key=lambda p: p.rank)
+
+    parts = []
+    used = 0
+    for passage in passages:
+        rendered = passage.render()
+        tokens = count_tokens(rendered) + 2
+        if used + tokens <= budget:
+            parts.append(rendered)
+            used += tokens
+            continue
+
+        remaining = budget - used - count_tokens(passage.label) - 2
+        if remaining >= MIN_TRUNCATED_TOKENS:
+            parts.append(passage.render(truncate_tokens(passage.text, remaining)))
+            break
+
+    return "\n\n".join(parts)
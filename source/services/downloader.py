@@ -1,30 +1,56 @@
 import os
-import time
 import re
+import time
 import requests
-from urllib.parse import urlparse
+from html.parser import HTMLParser
+from urllib.parse import urlparse, urljoin
 from fake_useragent import UserAgent
 
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
+
+from db.document_store import DocumentStore
+from source.services import pdf_url_cache
+from source.services.browser_pool import get_browser_pool
+from source.services.metrics import observe, span
+
+
+PDF_LINK_SELECTOR = "meta[name='citation_pdf_url'], a[href*='.pdf'], a[href*='_pdf']"
+
+# Адрес Semantic Scholar и набор ступеней настраиваются, чтобы нагрузочный стенд
+# мог направить загрузчик на локальные заглушки: DOWNLOAD_TIERS=http
+SEMANTIC_SCHOLAR_API = os.getenv("SEMANTIC_SCHOLAR_API", "https://api.semanticscholar.org/graph/v1")
+DOWNLOAD_TIERS = [t.strip() for t in os.getenv("DOWNLOAD_TIERS", "api,heuristic,http,selenium").split(",") if t.strip()]
+
+
+class _CitationMetaParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.pdf_url = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "meta" or self.pdf_url:
+            return
+        attrs = dict(attrs)
+        if attrs.get("name") == "citation_pdf_url" and attrs.get("content"):
+            self.pdf_url = attrs["content"]
 
 
 class Downloader:
-    def __init__(self, save_dir="../data_sources"):
-        self.save_dir = save_dir
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
+    def __init__(self, save_dir="../data_sources", store: DocumentStore | None = None):
+        self.save_dir = store.root_dir if store is not None else save_dir
+        if not os.path.exists(self.save_dir):
+            os.makedirs(self.save_dir)
+        # Каталог общий с пайплайном загрузки, иначе claim() не найдёт скачанный файл
+        self.store = store if store is not None else DocumentStore(self.save_dir)
         self.ua = UserAgent()
 
     def _sanitize_filename(self, title):
         return re.sub(r'[\\/*?:"<>|]', "", title)[:150] + ".pdf"
 
-    def _download_stream(self, url, filename, cookies=None, referer=None):
+    def _download_stream(self, url, cookies=None, referer=None):
         headers = {'User-Agent': self.ua.random}
         if referer:
             headers['Referer'] = referer
@@ -37,73 +63,173 @@ class Downloader:
                 if 'pdf' not in content_type and 'octet-stream' not in content_type:
                     print(f"Внимание: Тип содержимого '{content_type}', возможно это не PDF.")
 
-                filepath = os.path.join(self.save_dir, filename)
-                with open(filepath, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        f.write(chunk)
-            print(f"Файл успешно сохранен: {filepath}")
-            return True
+                stored = self.store.write_stream(r.iter_content(chunk_size=65536), source_url=url)
+            print(f"Файл успешно сохранен: {stored['path']}")
+            return stored
         except Exception as e:
             print(f"Ошибка при скачивании файла: {e}")
-            return False
+            return None
 
-    def try_selenium(self, url):
-        print("\n[Шаг 3] Запуск Selenium (Имитация браузера)...")
+    def resolve_api(self, url):
+        print("\n[Шаг 1] Попытка через Semantic Scholar API...")
+        api_endpoint = f"{SEMANTIC_SCHOLAR_API}/paper/URL:{url}?fields=title,openAccessPdf,externalIds"
+
+        try:
+            r = requests.get(api_endpoint, headers={"User-Agent": self.ua.random}, timeout=10)
+            if r.status_code == 200:
+                pdf_info = r.json().get('openAccessPdf')
+                if pdf_info and pdf_info.get('url'):
+                    print("Найдена Open Access ссылка через API!")
+                    return {"pdf_url": pdf_info['url']}
+                print("Статья найдена в базе, но нет прямой ссылки на PDF.")
+            else:
+                print(f"API не вернул данных (Код: {r.status_code}).")
+        except Exception as e:
+            print(f"Ошибка подключения к API: {e}")
+        return None
 
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument(f"user-agent={self.ua.random}")
-        chrome_options.add_argument("--disable-blink-features=AutomationControlled")
+    def resolve_heuristic(self, url):
+        print("\n[Шаг 2] Попытка через преобразование ссылки (J-STAGE Heuristic)...")
+        if "jstage.jst.go.jp" in url and "_html" in url:
+            pdf_url = url.replace("_html", "_pdf")
+            if "/-char/" in pdf_url:
+                pdf_url = pdf_url.split("/-char/")[0]
+
+            print(f"Сгенерирована вероятная ссылка: {pdf_url}")
+            try:
+                check = requests.head(pdf_url, headers={'User-Agent': self.ua.random}, timeout=5)
+                if check.status_code == 200 and 'pdf' in check.headers.get('Content-Type', ''):
+                    return {"pdf_url": pdf_url, "referer": url}
+            except Exception:
+                pass
+        print("Эвристический метод не сработал.")
+        return None
+
+    def resolve_http(self, url):
+        print("\n[Шаг 3] Попытка через HTTP (мета-тег citation_pdf_url)...")
+        try:
+            r = requests.get(url, headers={'User-Agent': self.ua.random}, timeout=15)
+            r.raise_for_status()
+            if 'pdf' in r.headers.get('content-type', '').lower():
+                return {"pdf_url": r.url, "landing_url": r.url}
+
+            parser = _CitationMetaParser()
+            parser.feed(r.text)
+            if parser.pdf_url:
+                print("Найден мета-тег citation_pdf_url.")
+                return {
+                    "pdf_url": urljoin(r.url, parser.pdf_url),
+                    "referer": r.url,
+                    "cookies": r.cookies.get_dict(),
+                    "landing_url": r.url,
+                }
+        except Exception as e:
+            print(f"Ошибка HTTP запроса: {e}")
+        print("Мета-тег citation_pdf_url не найден.")
+        return None
+
+    def resolve_selenium(self, url):
+        print("\n[Шаг 4] Запуск Selenium (Имитация браузера)...")
 
-        driver = None
         try:
-            driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-            driver.get(url)
+            with get_browser_pool().session() as driver:
+                driver.get(url)
 
-            WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-            time.sleep(2)
+                WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+                try:
+                    WebDriverWait(driver, 5).until(EC.presence_of_element_located((By.CSS_SELECTOR, PDF_LINK_SELECTOR)))
+                except TimeoutException:
+                    pass
 
-            pdf_link = None
+                pdf_link = None
 
-            try:
-                meta_pdf = driver.find_element(By.CSS_SELECTOR, "meta[name='citation_pdf_url']")
-                if meta_pdf:
-                    pdf_link = meta_pdf.get_attribute("content")
+                metas = driver.find_elements(By.CSS_SELECTOR, "meta[name='citation_pdf_url']")
+                if metas:
+                    pdf_link = metas[0].get_attribute("content")
                     print("Найден мета-тег citation_pdf_url.")
-            except:
-                pass
 
-            if not pdf_link:
-                anchors = driver.find_elements(By.TAG_NAME, "a")
-                for a in anchors:
-                    href = a.get_attribute("href")
-                    text = a.text.upper()
-                    if href and ("_pdf" in href or ".pdf" in href or "PDF" in text):
-                        if "citation" not in href.lower():
-                            pdf_link = href
-                            print(f"Найдена ссылка на странице: {href}")
-                            break
-
-            if pdf_link:
-                selenium_cookies = {cookie['name']: cookie['value'] for cookie in driver.get_cookies()}
-                return self._download_stream(pdf_link, "scraped_article.pdf", cookies=selenium_cookies, referer=url)
-            else:
-                print("Не удалось найти PDF на странице через Selenium.")
-                return False
+                if not pdf_link:
+                    anchors = driver.find_elements(By.TAG_NAME, "a")
+                    for a in anchors:
+                        href = a.get_attribute("href")
+                        text = a.text.upper()
+                        if href and ("_pdf" in href or ".pdf" in href or "PDF" in text):
+                            if "citation" not in href.lower():
+                                pdf_link = href
+                                print(f"Найдена ссылка на странице: {href}")
+                                break
+
+                if pdf_link:
+                    selenium_cookies = {cookie['name']: cookie['value'] for cookie in driver.get_cookies()}
+                    return {"pdf_url": pdf_link, "cookies": selenium_cookies, "referer": url}
+                else:
+                    print("Не удалось найти PDF на странице через Selenium.")
+                    return None
 
         except Exception as e:
             print(f"Ошибка Selenium: {e}")
+            return None
+
+    def resolve(self, url):
+        timings = {}
+
+        started = time.perf_counter()
+        cached = pdf_url_cache.get_cached(url)
+        timings["cache"] = time.perf_counter() - started
+        observe("download_tier_seconds", timings["cache"], tier="cache", outcome="hit" if cached else "miss")
+        if cached:
+            print(f"Ссылка на PDF найдена в кэше: {cached['pdf_url']}")
+            cached["tier"] = "cache"
+            cached["timings"] = timings
+            return cached
+
+        resolvers = {
+            "api": self.resolve_api,
+            "heuristic": self.resolve_heuristic,
+            "http": self.resolve_http,
+            "selenium": self.resolve_selenium,
+        }
+        tiers = [(tier, resolvers[tier]) for tier in DOWNLOAD_TIERS if tier in resolvers]
+        for tier, resolver in tiers:
+            started = time.perf_counter()
+            resolved = resolver(url)
+            timings[tier] = time.perf_counter() - started
+            observe("download_tier_seconds", timings[tier], tier=tier, outcome="hit" if resolved else "miss")
+            if resolved:
+                resolved["tier"] = tier
+                resolved["timings"] = timings
+                pdf_url_cache.remember([url, resolved.pop("landing_url", None)], resolved)
+                return resolved
+        return None
+
+    def download(self, resolved):
+        with span("download_tier_seconds", tier="download", outcome="done"):
+            return self._download_stream(
+                resolved["pdf_url"],
+                cookies=resolved.get("cookies"),
+                referer=resolved.get("referer")
+            )
+
+    def try_selenium(self, url):
+        resolved = self.resolve_selenium(url)
+        if not resolved:
             return False
-        finally:
-            if driver:
-                driver.quit()
+        return self.download(resolved)
 
     def process(self, url):
         print(f"\n{'=' * 60}\nОбработка: {url}\n{'=' * 60}")
 
-        return self.try_selenium(url)
+        resolved = self.resolve(url)
+        if not resolved:
+            return False
+        if self.download(resolved):
+            return True
+        if resolved["tier"] != "cache":
+            return False
+
+        pdf_url_cache.forget(url)
+        resolved = self.resolve(url)
+        return bool(resolved) and bool(self.download(resolved))
 
 
 if __name__ == "__main__":
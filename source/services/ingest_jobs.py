@@ -0,0 +1,95 @@
+import json
+import os
+import time
+from array import array
+from uuid import uuid4
+
+from celery import chain
+
+from source.services.celery_app import celery_app, get_redis
+
+
+STAGES = ["resolve", "download", "parse", "embed", "upsert"]
+
+JOB_KEY = "ingest:job:{job_id}"
+VECTORS_KEY = "ingest:job:{job_id}:vectors"
+JOB_TTL = int(os.getenv("INGEST_JOB_TTL", "86400"))
+
+
+def save_stage(job_id: str, stage: str, info: dict) -> None:
+    client = get_redis()
+    key = JOB_KEY.format(job_id=job_id)
+    client.hset(key, stage, json.dumps(info, ensure_ascii=False))
+    client.expire(key, JOB_TTL)
+
+
+def save_vectors(job_id: str, vectors: dict[str, list[float]]) -> None:
+    """Векторы между embed и upsert идут через Redis в float32, а не JSON-списком в сообщении цепочки."""
+    if not vectors:
+        return
+    client = get_redis()
+    key = VECTORS_KEY.format(job_id=job_id)
+    client.hset(key, mapping={chunk_id: array("f", vector).tobytes() for chunk_id, vector in vectors.items()})
+    client.expire(key, JOB_TTL)
+
+
+def load_vectors(job_id: str, ids: list[str]) -> dict[str, list[float]]:
+    if not ids:
+        return {}
+    blobs = get_redis().hmget(VECTORS_KEY.format(job_id=job_id), ids)
+    return {chunk_id: array("f", blob).tolist() for chunk_id, blob in zip(ids, blobs) if blob is not None}
+
+
+def drop_vectors(job_id: str) -> None:
+    get_redis().delete(VECTORS_KEY.format(job_id=job_id))
+
+
+def create_job(url: str) -> str:
+    job_id = str(uuid4())
+    client = get_redis()
+    key = JOB_KEY.format(job_id=job_id)
+    client.hset(key, mapping={
+        "url": url,
+        "created_at": time.time(),
+        **{stage: json.dumps({"status": "PENDING"}) for stage in STAGES},
+    })
+    client.expire(key, JOB_TTL)
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    raw = get_redis().hgetall(JOB_KEY.format(job_id=job_id))
+    if not raw:
+        return None
+    raw = {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v
+           for k, v in raw.items()}
+
+    stages = {stage: json.loads(raw[stage]) for stage in STAGES if stage in raw}
+    statuses = [info["status"] for info in stages.values()]
+    if "FAILURE" in statuses:
+        status = "FAILURE"
+    elif all(s in ("SUCCESS", "SKIPPED") for s in statuses):
+        status = "SUCCESS"
+    elif all(s == "PENDING" for s in statuses):
+        status = "PENDING"
+    else:
+        status = "PROGRESS"
+
+    return {
+        "job_id": job_id,
+        "url": raw.get("url"),
+        "status": status,
+        "stages": stages,
+    }
+
+
+def start_ingest(url: str) -> str:
+    job_id = create_job(url)
+    chain(
+        celery_app.signature("source.services.ingest_pipeline.resolve_article", args=(job_id, url)),
+        celery_app.signature("source.services.ingest_pipeline.download_article", args=(job_id,)),
+        celery_app.signature("source.services.ingest_pipeline.parse_article", args=(job_id,)),
+        celery_app.signature("source.services.ingest_pipeline.embed_article", args=(job_id,)),
+        celery_app.signature("source.services.ingest_pipeline.upsert_article", args=(job_id,)),
+    ).apply_async()
+    return job_id
@@ -0,0 +1,150 @@
+import os
+import time
+from contextlib import contextmanager
+
+from celery import shared_task
+from langchain_core.documents import Document
+
+from db.document_store import DocumentStore
+from db.populate_db import load_chunks, stable_chunk_ids, existing_chunk_ids, sync_document, get_embedding_function
+from source.services import pdf_url_cache
+from source.services.answer_cache import invalidate_sources
+from source.services.downloader import Downloader
+from source.services.ingest_jobs import STAGES, drop_vectors, load_vectors, save_stage, save_vectors
+
+
+DATA_SOURCES_DIR = os.getenv("DATA_SOURCES_DIR", "../data_sources")
+
+_document_store: DocumentStore | None = None
+_downloader: Downloader | None = None
+
+
+class IngestError(Exception):
+    pass
+
+
+@contextmanager
+def _stage(job_id: str, stage: str):
+    started = time.time()
+    details = {}
+    save_stage(job_id, stage, {"status": "STARTED", "started_at": started})
+    try:
+        yield details
+    except Exception as e:
+        save_stage(job_id, stage, {
+            "status": "FAILURE",
+            "started_at": started,
+            "duration": time.time() - started,
+            "error": str(e),
+            **details,
+        })
+        raise
+    save_stage(job_id, stage, {
+        "status": "SUCCESS",
+        "started_at": started,
+        "duration": time.time() - started,
+        **details,
+    })
+
+
+def get_document_store() -> DocumentStore:
+    global _document_store
+    if _document_store is None:
+        _document_store = DocumentStore(DATA_SOURCES_DIR)
+    return _document_store
+
+
+def get_downloader() -> Downloader:
+    global _downloader
+    if _downloader is None:
+        _downloader = Downloader(store=get_document_store())
+    return _downloader
+
+
+def _to_documents(chunks: list[dict]) -> list[Document]:
+    return [Document(page_content=c["page_content"], metadata=c["metadata"]) for c in chunks]
+
+
+@shared_task(name="source.services.ingest_pipeline.resolve_article", ignore_result=True)
+def resolve_article(job_id: str, url: str) -> dict:
+    with _stage(job_id, "resolve") as details:
+        resolved = get_downloader().resolve(url)
+        if not resolved:
+            raise IngestError("Не удалось найти PDF по этой ссылке")
+        details["tier"] = resolved["tier"]
+        details["timings"] = resolved["timings"]
+    resolved["url"] = url
+    return resolved
+
+
+@shared_task(bind=True, name="source.services.ingest_pipeline.download_article", ignore_result=True)
+def download_article(self, resolved: dict, job_id: str) -> dict:
+    with _stage(job_id, "download") as details:
+        stored = get_downloader().download(resolved)
+        if not stored:
+            if resolved.get("tier") == "cache":
+                pdf_url_cache.forget(resolved["url"])
+            raise IngestError("Не удалось скачать PDF")
+        details["sha256"] = stored["sha256"]
+        details["size"] = stored["size"]
+
+        if not get_document_store().claim(stored["sha256"]):
+            details["duplicate"] = True
+            self.request.chain = None
+
+    if self.request.chain is None:
+        for stage in STAGES[STAGES.index("download") + 1:]:
+            save_stage(job_id, stage, {"status": "SKIPPED"})
+    return stored
+
+
+@shared_task(name="source.services.ingest_pipeline.parse_article", ignore_result=True)
+def parse_article(stored: dict, job_id: str) -> dict:
+    try:
+        with _stage(job_id, "parse"):
+            chunks = load_chunks(stored["path"])
+            if not chunks:
+                raise IngestError("Документ пуст или не читается")
+    except Exception as e:
+        get_document_store().mark_failed(stored["sha256"], str(e))
+        raise
+    ids = stable_chunk_ids(stored["sha256"], chunks)
+    return {
+        "sha256": stored["sha256"],
+        "ids": ids,
+        "chunks": [{"page_content": c.page_content, "metadata": c.metadata} for c in chunks],
+    }
+
+
+@shared_task(name="source.services.ingest_pipeline.embed_article", ignore_result=True)
+def embed_article(parsed: dict, job_id: str) -> dict:
+    try:
+        with _stage(job_id, "embed") as details:
+            existing = existing_chunk_ids(parsed["sha256"])
+            new = [(chunk_id, c["page_content"]) for chunk_id, c in zip(parsed["ids"], parsed["chunks"])
+                   if chunk_id not in existing]
+            vectors = get_embedding_function().embed_documents([text for _, text in new]) if new else []
+            save_vectors(job_id, {chunk_id: vector for (chunk_id, _), vector in zip(new, vectors)})
+            details["embedded"] = len(new)
+            details["reused"] = len(parsed["ids"]) - len(new)
+    except Exception as e:
+        get_document_store().mark_failed(parsed["sha256"], str(e))
+        raise
+    return parsed
+
+
+@shared_task(name="source.services.ingest_pipeline.upsert_article")
+def upsert_article(embedded: dict, job_id: str) -> int:
+    try:
+        with _stage(job_id, "upsert") as details:
+            chunks = _to_documents(embedded["chunks"])
+            # Векторы, истёкшие в Redis, sync_document досчитает сам
+            vectors = load_vectors(job_id, embedded["ids"])
+            details.update(sync_document(embedded["sha256"], chunks, embedded["ids"], embeddings=vectors))
+            drop_vectors(job_id)
+            invalidate_sources({str(c.metadata["source"]) for c in chunks if "source" in c.metadata})
+    except Exception as e:
+        get_document_store().mark_failed(embedded["sha256"], str(e))
+        raise
+    get_document_store().mark_ingested(embedded["sha256"], len(chunks))
+    return len(chunks)
@@ -1,47 +1,157 @@
+import json
 import os
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from celery import shared_task
-from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+from db.retriever import SEARCH_KWARGS, get_retriever
+from source.services.answer_cache import answer_cache, context_fingerprint, cited_sources
+from source.services.celery_app import STREAM_CHANNEL, get_redis
+from source.services.llm_client import LLMError
+from source.services.llm_router import get_llm_router
+from source.services.metrics import span
+from source.services.promt import build_prompt
+from source.services.rate_limiter import LANE_BULK, LANE_INTERACTIVE
+
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+
+def _retrieve(text: str) -> tuple[list[Document], list[float]]:
+    retriever = get_retriever()
+    documents = retriever.search(text, **SEARCH_KWARGS)
+    query_vector = retriever.embeddings.embed_query(text)
+    return documents, query_vector
+
+
+def _answer(
+        text: str,
+        documents: list[Document],
+        query_vector: list[float],
+        lane: str = LANE_INTERACTIVE
+) -> dict:
+    fingerprint = context_fingerprint(documents)
 
-from source.services.promt import get_prompt
+    cached = answer_cache.get(query_vector, fingerprint)
+    if cached is not None:
+        return {"answer": cached, "cached": True, "model": None}
 
-load_dotenv()
-API_KEY = os.getenv("API_KEY")
+    prompt = build_prompt(text, documents)
+
+    try:
+        with span("llm_request_seconds", mode="complete", model="none") as labels:
+            content, model = get_llm_router().complete(prompt, lane=lane)
+            labels["model"] = model
+    except LLMError as err:
+        return {"answer": None, "cached": False, "error": err.to_dict()}
+
+    answer_cache.put(query_vector, fingerprint, content, cited_sources(documents))
+    return {"answer": content, "cached": False, "model": model}
 
 
 @shared_task(name="source.services.llm.get_llm_response")
-def get_llm_response(text: str) -> str:
-    prompt = get_prompt(text)
-    url = "https://openrouter.ai/api/v1/chat/completions"
+def get_llm_response(text: str) -> dict:
+    documents, query_vector = _retrieve(text)
+    return _answer(text, documents, query_vector)
+
 
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
+@shared_task(name="source.services.llm.build_llm_prompt")
+def build_llm_prompt(text: str) -> dict:
+    """Поиск и сборка промпта для /hypothesis/direct: модель эмбеддингов живёт только в воркерах.
+
+    Вектор запроса, отпечаток контекста и источники нужны API для кэша ответов.
+    """
+    documents, query_vector = _retrieve(text)
+    return {
+        "prompt": build_prompt(text, documents),
+        "query_vector": query_vector,
+        "fingerprint": context_fingerprint(documents),
+        "sources": sorted(cited_sources(documents)),
     }
 
-    payload = {
-        "model": "google/gemini-2.0-flash-exp:free",
-        "messages": [
-            {
-                "role": "user",
-                "content": prompt
+
+@shared_task(bind=True, name="source.services.llm.get_llm_response_batch")
+def get_llm_response_batch(self, texts: list[str]) -> dict:
+    retriever = get_retriever()
+    document_batches = retriever.search_batch(texts, **SEARCH_KWARGS)
+    query_vectors = retriever.embeddings.embed_queries(texts)
+
+    items = [{"status": "PENDING"} for _ in texts]
+    lock = threading.Lock()
+    self.update_state(state="PROGRESS", meta={"items": items})
+
+    def run(i: int) -> None:
+        try:
+            result = _answer(texts[i], document_batches[i], query_vectors[i], lane=LANE_BULK)
+        except Exception as e:
+            # Падение одного запроса не должно валить весь пакет
+            result = {
+                "answer": None,
+                "cached": False,
+                "error": {"type": "internal_error", "detail": str(e), "status_code": None},
             }
-        ]
-    }
+        result["status"] = "FAILURE" if result.get("error") else "SUCCESS"
+        with lock:
+            items[i] = result
+            self.update_state(state="PROGRESS", meta={"items": items})
+
+    with ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY) as pool:
+        list(pool.map(run, range(len(texts))))
+
+    return {"items": items}
+
+
+def _stream_answer(text: str, publish) -> dict:
+    documents, query_vector = _retrieve(text)
+    fingerprint = context_fingerprint(documents)
+
+    cached = answer_cache.get(query_vector, fingerprint)
+    if cached is not None:
+        publish({"type": "token", "content": cached})
+        publish({"type": "done", "cached": True, "model": None})
+        return {"answer": cached, "cached": True, "model": None}
 
+    prompt = build_prompt(text, documents)
+
+    parts = []
+    model = None
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        if 'choices' in data and len(data['choices']) > 0:
-            content = data['choices'][0]['message']['content']
-            return content
-        else:
-            return "Ошибка: Пустой ответ от модели"
+        with span("llm_request_seconds", mode="stream", model="none") as labels:
+            for model, token in get_llm_router().stream(prompt):
+                labels["model"] = model
+                parts.append(token)
+                publish({"type": "token", "content": token})
+        if not parts:
+            raise LLMError("empty_response", "Пустой ответ от модели")
+    except LLMError as err:
+        publish({"type": "error", "error": err.to_dict()})
+        return {"answer": None, "cached": False, "error": err.to_dict()}
+
+    content = "".join(parts)
+
+    answer_cache.put(query_vector, fingerprint, content, cited_sources(documents))
+    publish({"type": "done", "cached": False, "model": model})
+    return {"answer": content, "cached": False, "model": model}
+
 
-    except requests.exceptions.HTTPError as http_err:
-        return f"HTTP error occurred: {http_err}"
-    except Exception as err:
-        return f"Other error occurred: {err}"
+@shared_task(bind=True, name="source.services.llm.stream_llm_response")
+def stream_llm_response(self, text: str) -> dict:
+    channel = STREAM_CHANNEL.format(task_id=self.request.id)
+    client = get_redis()
+
+    def publish(event: dict) -> None:
+        client.publish(channel, json.dumps(event, ensure_ascii=False))
+
+    try:
+        return _stream_answer(text, publish)
+    except Exception as e:
+        # Иначе SSE-клиент ждёт до таймаута простоя, не узнав о падении задачи
+        try:
+            publish({"type": "error", "error": {"type": "internal_error", "detail": str(e), "status_code": None}})
+        except Exception as publish_error:
+            print(f"Не удалось отправить событие об ошибке: {publish_error}")
+        raise
 
 
 if __name__ == "__main__":
@@ -49,4 +159,4 @@ if __name__ == "__main__":
     print("Запрос отправлен...")
     answer = get_llm_response(test_question)
     print("\nОТВЕТ ОТ НЕЙРОСЕТИ:\n")
-    print(answer)
\ No newline at end of file
+    print(answer)
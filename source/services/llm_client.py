@@ -0,0 +1,408 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import httpx
+from dotenv import load_dotenv
+
+from source.services.metrics import observe
+from source.services.rate_limiter import (
+    LANE_INTERACTIVE,
+    LLM_COMPLETION_TOKENS,
+    RateLimitTimeout,
+    close_rate_limiters,
+    get_rate_limiter,
+)
+
+load_dotenv()
+API_KEY = os.getenv("API_KEY")
+
+LLM_URL = os.getenv("LLM_URL", "https://openrouter.ai/api/v1/chat/completions")
+LLM_MODEL = os.getenv("LLM_MODEL", "google/gemini-2.0-flash-exp:free")
+
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+STREAM_DONE = object()
+
+
+class LLMError(Exception):
+    def __init__(self, kind: str, detail: str, status_code: int | None = None, retryable: bool = False) -> None:
+        super().__init__(detail)
+        self.kind = kind
+        self.detail = detail
+        self.status_code = status_code
+        self.retryable = retryable
+
+    def to_dict(self) -> dict:
+        return {
+            "type": self.kind,
+            "detail": self.detail,
+            "status_code": self.status_code,
+        }
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+
+
+def _headers() -> dict:
+    return {"Authorization": f"Bearer {API_KEY}"}
+
+
+def build_payload(prompt: str, stream: bool = False, model: str | None = None) -> dict:
+    payload = {
+        "model": model or LLM_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+
+def _retry_after(response: httpx.Response | None) -> float | None:
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int, error: LLMError, response: httpx.Response | None) -> float:
+    retry_after = _retry_after(response)
+    if retry_after is not None:
+        return min(retry_after, LLM_BACKOFF_MAX)
+    delay = min(LLM_BACKOFF_BASE * (2 ** attempt), LLM_BACKOFF_MAX)
+    return delay * (0.5 + random.random() / 2)
+
+
+def _check_status(response: httpx.Response) -> None:
+    if response.status_code < 400:
+        return
+    raise LLMError(
+        "rate_limited" if response.status_code == 429 else "http_error",
+        f"{response.status_code}: {response.text[:500]}",
+        status_code=response.status_code,
+        retryable=response.status_code in RETRYABLE_STATUS
+    )
+
+
+def _transport_error(err: httpx.HTTPError) -> LLMError:
+    kind = "timeout" if isinstance(err, httpx.TimeoutException) else "connection_error"
+    return LLMError(kind, str(err) or kind, retryable=True)
+
+
+def _request_tokens(payload: dict) -> int:
+    from source.services.context_packer import count_tokens
+
+    prompt = "".join(message["content"] for message in payload["messages"])
+    return count_tokens(prompt) + LLM_COMPLETION_TOKENS
+
+
+def _acquire(payload: dict, lane: str) -> float:
+    try:
+        waited = get_rate_limiter(payload["model"]).acquire(_request_tokens(payload), lane)
+    except RateLimitTimeout as err:
+        raise LLMError("rate_limited", str(err))
+    observe("llm_rate_limit_wait_seconds", waited, model=payload["model"], lane=lane)
+    return waited
+
+
+async def _acquire_async(payload: dict, lane: str) -> None:
+    try:
+        waited = await get_rate_limiter(payload["model"]).acquire_async(_request_tokens(payload), lane)
+    except RateLimitTimeout as err:
+        raise LLMError("rate_limited", str(err))
+    observe("llm_rate_limit_wait_seconds", waited, model=payload["model"], lane=lane)
+
+
+def _parse_completion(response: httpx.Response) -> str:
+    try:
+        data = response.json()
+    except ValueError:
+        raise LLMError("invalid_response", response.text[:500])
+    choices = data.get("choices") or []
+    if not choices:
+        raise LLMError("empty_response", "Пустой ответ от модели")
+    content = choices[0].get("message", {}).get("content")
+    if not content:
+        raise LLMError("empty_response", "Пустой ответ от модели")
+    return content
+
+
+def _parse_stream_line(line: str):
+    if not line or not line.startswith("data: "):
+        return None
+    data = line[len("data: "):]
+    if data == "[DONE]":
+        return STREAM_DONE
+    try:
+        chunk = json.loads(data)
+    except ValueError:
+        raise LLMError("invalid_response", data[:500])
+    if "error" in chunk:
+        raise LLMError("stream_error", str(chunk["error"]))
+    choices = chunk.get("choices") or []
+    if not choices:
+        return None
+    return choices[0].get("delta", {}).get("content") or None
+
+
+class StreamControl:
+    """Связь потока с тем, кто его запустил: отмена из другого потока и момент отправки запроса."""
+
+    def __init__(self, on_sent=None) -> None:
+        self.cancelled = threading.Event()
+        self.on_sent = on_sent
+        self.sent_at: float | None = None
+        self.throttled = False
+        self._network_stream = None
+        self._lock = threading.Lock()
+
+    def sent(self) -> None:
+        # Часы TTFT запускаются после лимитера, чтобы ожидание квоты не попадало в задержку модели
+        self.sent_at = time.perf_counter()
+        if self.on_sent is not None:
+            self.on_sent()
+
+    def trace(self, event: str, info: dict) -> None:
+        # Новое соединение видно ещё до заголовков ответа; переиспользованное - только после них
+        if event == "connection.connect_tcp.complete":
+            self._attach(info.get("return_value"))
+
+    def _attach(self, network_stream) -> None:
+        with self._lock:
+            self._network_stream = network_stream
+            if self.cancelled.is_set():
+                self._shutdown()
+
+    def _shutdown(self) -> None:
+        try:
+            sock = self._network_stream.get_extra_info("socket") if self._network_stream is not None else None
+            if sock is not None:
+                # shutdown, а не close: будит поток, заблокированный в чтении сокета
+                sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    @contextmanager
+    def attached(self, response: httpx.Response):
+        self._attach(response.extensions.get("network_stream"))
+        try:
+            yield
+        finally:
+            # Соединение вернётся в пул, отмена больше не должна его трогать
+            with self._lock:
+                self._network_stream = None
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        with self._lock:
+            self._shutdown()
+
+
+class LLMClient:
+    def __init__(self) -> None:
+        self.client = httpx.Client(timeout=_timeout(), limits=_limits(), headers=_headers())
+
+    def _post(self, payload: dict, lane: str) -> httpx.Response:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            response = None
+            _acquire(payload, lane)
+            try:
+                response = self.client.post(LLM_URL, json=payload)
+                _check_status(response)
+                return response
+            except httpx.HTTPError as err:
+                error = _transport_error(err)
+            except LLMError as err:
+                error = err
+            if not error.retryable or attempt == LLM_MAX_RETRIES:
+                raise error
+            delay = _backoff(attempt, error, response)
+            if error.status_code == 429:
+                get_rate_limiter(payload["model"]).block(delay)
+            time.sleep(delay)
+
+    def complete(self, prompt: str, model: str | None = None, lane: str = LANE_INTERACTIVE) -> str:
+        response = self._post(build_payload(prompt, model=model), lane)
+        return _parse_completion(response)
+
+    def stream(
+            self,
+            prompt: str,
+            model: str | None = None,
+            lane: str = LANE_INTERACTIVE,
+            control: StreamControl | None = None
+    ):
+        """Отменённый через control поток завершается без ошибки и без повторов."""
+        payload = build_payload(prompt, stream=True, model=model)
+        control = control or StreamControl()
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if control.cancelled.is_set():
+                return
+            started = False
+            response = None
+            _acquire(payload, lane)
+            if control.cancelled.is_set():
+                return
+            control.sent()
+            try:
+                with self.client.stream("POST", LLM_URL, json=payload, extensions={"trace": control.trace}) as response:
+                    with control.attached(response):
+                        if response.status_code >= 400:
+                            response.read()
+                        _check_status(response)
+                        for line in response.iter_lines():
+                            content = _parse_stream_line(line)
+                            if content is STREAM_DONE:
+                                return
+                            if content:
+                                started = True
+                                yield content
+                return
+            except httpx.HTTPError as err:
+                error = _transport_error(err)
+            except LLMError as err:
+                error = err
+            if control.cancelled.is_set():
+                return
+            if started or not error.retryable or attempt == LLM_MAX_RETRIES:
+                raise error
+            delay = _backoff(attempt, error, response)
+            if error.status_code == 429:
+                control.throttled = True
+                get_rate_limiter(payload["model"]).block(delay)
+            if control.cancelled.wait(delay):
+                return
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class AsyncLLMClient:
+    def __init__(self) -> None:
+        self.client = httpx.AsyncClient(timeout=_timeout(), limits=_limits(), headers=_headers())
+
+    async def _post(self, payload: dict, lane: str) -> httpx.Response:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            response = None
+            await _acquire_async(payload, lane)
+            try:
+                response = await self.client.post(LLM_URL, json=payload)
+                _check_status(response)
+                return response
+            except httpx.HTTPError as err:
+                error = _transport_error(err)
+            except LLMError as err:
+                error = err
+            if not error.retryable or attempt == LLM_MAX_RETRIES:
+                raise error
+            delay = _backoff(attempt, error, response)
+            if error.status_code == 429:
+                await get_rate_limiter(payload["model"]).block_async(delay)
+            await asyncio.sleep(delay)
+
+    async def complete(self, prompt: str, model: str | None = None, lane: str = LANE_INTERACTIVE) -> str:
+        response = await self._post(build_payload(prompt, model=model), lane)
+        return _parse_completion(response)
+
+    async def stream(self, prompt: str, model: str | None = None, lane: str = LANE_INTERACTIVE):
+        payload = build_payload(prompt, stream=True, model=model)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            started = False
+            response = None
+            await _acquire_async(payload, lane)
+            try:
+                async with self.client.stream("POST", LLM_URL, json=payload) as response:
+                    if response.status_code >= 400:
+                        await response.aread()
+                    _check_status(response)
+                    async for line in response.aiter_lines():
+                        content = _parse_stream_line(line)
+                        if content is STREAM_DONE:
+                            return
+                        if content:
+                            started = True
+                            yield content
+                return
+            except httpx.HTTPError as err:
+                error = _transport_error(err)
+            except LLMError as err:
+                error = err
+            if started or not error.retryable or attempt == LLM_MAX_RETRIES:
+                raise error
+            delay = _backoff(attempt, error, response)
+            if error.status_code == 429:
+                await get_rate_limiter(payload["model"]).block_async(delay)
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+_sync_client: LLMClient | None = None
+_async_client: AsyncLLMClient | None = None
+_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    global _sync_client
+    if _sync_client is None:
+        with _lock:
+            if _sync_client is None:
+                _sync_client = LLMClient()
+    return _sync_client
+
+
+def get_async_llm_client() -> AsyncLLMClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncLLMClient()
+    return _async_client
+
+
+def close_llm_client() -> None:
+    global _sync_client
+    with _lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
+
+
+async def close_llm_clients() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    await close_rate_limiters()
+    close_llm_client()
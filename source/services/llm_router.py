@@ -0,0 +1,276 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from source.services.celery_app import get_redis
+from source.services.llm_client import LLMError, LLM_MODEL, StreamControl, get_llm_client
+from source.services.metrics import inc, observe
+from source.services.rate_limiter import LANE_INTERACTIVE
+
+
+# Модели в порядке предпочтения; первая - основная, следующие - для хеджа и фолбэка
+LLM_MODELS = [m.strip() for m in os.getenv("LLM_MODELS", LLM_MODEL).split(",") if m.strip()]
+
+LLM_ROUTER_THREADS = int(os.getenv("LLM_ROUTER_THREADS", "16"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "1") == "1"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_DEFAULT_BUDGET = float(os.getenv("LLM_HEDGE_DEFAULT_BUDGET", "5"))
+LLM_HEDGE_MIN_BUDGET = float(os.getenv("LLM_HEDGE_MIN_BUDGET", "0.5"))
+LLM_HEDGE_MAX_BUDGET = float(os.getenv("LLM_HEDGE_MAX_BUDGET", "30"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+LLM_STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "200"))
+LLM_STATS_REFRESH = float(os.getenv("LLM_STATS_REFRESH", "5"))
+# Модель с долей ошибок выше порога в последнем окне уходит в конец очереди
+LLM_UNHEALTHY_ERROR_RATE = float(os.getenv("LLM_UNHEALTHY_ERROR_RATE", "0.5"))
+
+TTFT_KEY = "llm:model:{model}:ttft"
+OUTCOMES_KEY = "llm:model:{model}:outcomes"
+COUNTERS_KEY = "llm:model:{model}:counters"
+
+
+def _quantile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class ModelStats:
+    """Задержка первого токена и ошибки по моделям, общие для всех воркеров через Redis."""
+
+    def __init__(self, window: int = LLM_STATS_WINDOW, refresh: float = LLM_STATS_REFRESH) -> None:
+        self.window = window
+        self.refresh = refresh
+        self._snapshots: dict[str, tuple[float, dict]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, ok: bool, ttft: float | None = None) -> None:
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            if ttft is not None:
+                pipe.lpush(TTFT_KEY.format(model=model), ttft)
+                pipe.ltrim(TTFT_KEY.format(model=model), 0, self.window - 1)
+            pipe.lpush(OUTCOMES_KEY.format(model=model), 1 if ok else 0)
+            pipe.ltrim(OUTCOMES_KEY.format(model=model), 0, self.window - 1)
+            pipe.hincrby(COUNTERS_KEY.format(model=model), "requests", 1)
+            if not ok:
+                pipe.hincrby(COUNTERS_KEY.format(model=model), "errors", 1)
+            pipe.execute()
+        except Exception as e:
+            print(f"Не удалось записать статистику модели {model}: {e}")
+
+    def bump(self, model: str, name: str) -> None:
+        try:
+            get_redis().hincrby(COUNTERS_KEY.format(model=model), name, 1)
+        except Exception as e:
+            print(f"Не удалось записать статистику модели {model}: {e}")
+
+    def _load(self, model: str) -> dict:
+        client = get_redis()
+        ttft = [float(v) for v in client.lrange(TTFT_KEY.format(model=model), 0, -1)]
+        outcomes = [int(v) for v in client.lrange(OUTCOMES_KEY.format(model=model), 0, -1)]
+        counters = {
+            (k.decode() if isinstance(k, bytes) else k): int(v)
+            for k, v in client.hgetall(COUNTERS_KEY.format(model=model)).items()
+        }
+        return {
+            "samples": len(ttft),
+            "ttft_p50": _quantile(ttft, 0.5),
+            "ttft_p95": _quantile(ttft, LLM_HEDGE_QUANTILE),
+            "error_rate": (outcomes.count(0) / len(outcomes)) if outcomes else 0.0,
+            **counters,
+        }
+
+    def snapshot(self, model: str) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._snapshots.get(model)
+            if cached is not None and now - cached[0] < self.refresh:
+                return cached[1]
+        try:
+            snapshot = self._load(model)
+        except Exception as e:
+            print(f"Статистика модели {model} недоступна: {e}")
+            snapshot = {"samples": 0, "ttft_p50": None, "ttft_p95": None, "error_rate": 0.0}
+        with self._lock:
+            self._snapshots[model] = (now, snapshot)
+        return snapshot
+
+
+class LLMRouter:
+    """Упорядоченный список моделей с хеджированием медленных и фолбэком упавших запросов."""
+
+    def __init__(self, models: list[str] | None = None, stats: ModelStats | None = None) -> None:
+        self.models = models or LLM_MODELS
+        self.stats = stats or ModelStats()
+        self._executor = ThreadPoolExecutor(max_workers=LLM_ROUTER_THREADS, thread_name_prefix="llm")
+
+    def ordered_models(self) -> list[str]:
+        healthy = []
+        unhealthy = []
+        for model in self.models:
+            snapshot = self.stats.snapshot(model)
+            (unhealthy if snapshot["error_rate"] > LLM_UNHEALTHY_ERROR_RATE else healthy).append(model)
+        return healthy + unhealthy
+
+    def hedge_budget(self, model: str) -> float:
+        snapshot = self.stats.snapshot(model)
+        if snapshot["samples"] < LLM_HEDGE_MIN_SAMPLES or snapshot["ttft_p95"] is None:
+            return LLM_HEDGE_DEFAULT_BUDGET
+        return min(LLM_HEDGE_MAX_BUDGET, max(LLM_HEDGE_MIN_BUDGET, snapshot["ttft_p95"]))
+
+    def _attempt(
+            self,
+            model: str,
+            prompt: str,
+            lane: str,
+            events: queue.Queue,
+            control: StreamControl,
+            emit_tokens: bool
+    ) -> None:
+        cancelled = control.cancelled
+        ttft = None
+        parts = []
+        stream = get_llm_client().stream(prompt, model=model, lane=lane, control=control)
+        try:
+            for token in stream:
+                if cancelled.is_set():
+                    break
+                if ttft is None:
+                    ttft = time.perf_counter() - control.sent_at
+                    events.put(("first_token", model, ttft))
+                parts.append(token)
+                if emit_tokens:
+                    events.put(("token", model, token))
+            if cancelled.is_set():
+                self.stats.bump(model, "cancelled")
+                return
+            if not parts:
+                raise LLMError("empty_response", "Пустой ответ от модели")
+        except LLMError as err:
+            if not cancelled.is_set():
+                self.stats.record(model, ok=False, ttft=None if control.throttled else ttft)
+                events.put(("error", model, err))
+            return
+        except Exception as err:
+            if not cancelled.is_set():
+                self.stats.record(model, ok=False, ttft=None if control.throttled else ttft)
+                events.put(("error", model, LLMError("connection_error", str(err) or type(err).__name__)))
+            return
+        finally:
+            stream.close()
+
+        observe("llm_first_token_seconds", ttft, model=model, lane=lane)
+        if not cancelled.is_set():
+            events.put(("done", model, "".join(parts)))
+        # После 429 задержка говорит о перегрузке провайдера, а не о модели: в бюджет хеджа не берём
+        self.stats.record(model, ok=True, ttft=None if control.throttled else ttft)
+
+    def _race(self, prompt: str, lane: str, first_token_wins: bool):
+        """Генератор событий гонки: ("token", model, text) и в конце ("done", model, content)."""
+        models = self.ordered_models()
+        events: queue.Queue = queue.Queue()
+        cancel: dict[str, StreamControl] = {}
+        next_index = 0
+        first_token_seen = False
+        hedged = False
+        last_error: LLMError | None = None
+        winner = None
+
+        def launch() -> str:
+            nonlocal next_index
+            model = models[next_index]
+            next_index += 1
+            # Бюджет хеджа отсчитывается с отправки запроса, а не с постановки в пул потоков
+            cancel[model] = StreamControl(on_sent=lambda: events.put(("sent", model, None)))
+            self._executor.submit(self._attempt, model, prompt, lane, events, cancel[model], first_token_wins)
+            return model
+
+        primary = launch()
+        budget = self.hedge_budget(primary)
+        deadline = None
+
+        try:
+            while cancel:
+                can_hedge = (
+                        LLM_HEDGE_ENABLED and deadline is not None
+                        and not hedged and not first_token_seen and next_index < len(models)
+                )
+                timeout = max(0.0, deadline - time.monotonic()) if can_hedge else None
+                try:
+                    kind, model, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedge = launch()
+                    hedged = True
+                    print(f"Нет первого токена от {primary} за {budget:.1f} с, хеджирую запросом к {hedge}")
+                    self.stats.bump(primary, "hedged")
+                    inc("llm_hedges_total", primary=primary, hedge=hedge)
+                    continue
+
+                if model != winner and winner is not None:
+                    continue
+
+                if kind == "sent":
+                    if model == primary and deadline is None:
+                        deadline = time.monotonic() + budget
+                elif kind == "first_token":
+                    first_token_seen = True
+                    if first_token_wins and winner is None:
+                        winner = model
+                        for other, control in cancel.items():
+                            if other != model:
+                                control.cancel()
+                elif kind == "token":
+                    if winner == model:
+                        yield "token", model, value
+                elif kind == "done":
+                    for other, control in cancel.items():
+                        if other != model:
+                            control.cancel()
+                    self.stats.bump(model, "wins")
+                    inc("llm_responses_total", model=model, hedged=str(hedged).lower())
+                    yield "done", model, value
+                    return
+                elif kind == "error":
+                    last_error = value
+                    cancel.pop(model)
+                    if winner == model:
+                        raise value
+                    if not cancel and next_index < len(models):
+                        print(f"Модель {model} вернула ошибку ({value.kind}), переключаюсь на {models[next_index]}")
+                        inc("llm_fallbacks_total", model=model)
+                        primary = launch()
+                        budget = self.hedge_budget(primary)
+                        deadline = None
+            raise last_error or LLMError("empty_response", "Ни одна модель не ответила")
+        finally:
+            for control in cancel.values():
+                control.cancel()
+
+    def complete(self, prompt: str, lane: str = LANE_INTERACTIVE) -> tuple[str, str]:
+        """Побеждает модель, первой закончившая ответ. Возвращает (ответ, модель)."""
+        for kind, model, value in self._race(prompt, lane, first_token_wins=False):
+            if kind == "done":
+                return value, model
+
+    def stream(self, prompt: str, lane: str = LANE_INTERACTIVE):
+        """Потоковый вариант: побеждает модель, первой выдавшая токен. Отдаёт (модель, токен)."""
+        for kind, model, value in self._race(prompt, lane, first_token_wins=True):
+            if kind == "token":
+                yield model, value
+
+
+_router: LLMRouter | None = None
+_router_lock = threading.Lock()
+
+
+def get_llm_router() -> LLMRouter:
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = LLMRouter()
+    return _router
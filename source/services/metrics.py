@@ -0,0 +1,212 @@
+import atexit
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Наблюдения копятся в памяти процесса и уходят в Redis одним пайплайном раз в интервал
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+METRICS_REDIS_TIMEOUT = float(os.getenv("METRICS_REDIS_TIMEOUT", "1"))
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+HISTOGRAMS_KEY = "metrics:histograms"
+COUNTERS_KEY = "metrics:counters"
+HELP = {
+    "retrieval_stage_seconds": "Время стадий поиска: эмбеддинг запроса, ANN/MMR, соседние чанки",
+    "prompt_build_seconds": "Время сборки промпта",
+    "llm_request_seconds": "Время запроса к OpenRouter",
+    "llm_rate_limit_wait_seconds": "Время ожидания лимитера перед запросом к OpenRouter",
+    "llm_first_token_seconds": "Время до первого токена по моделям",
+    "llm_hedges_total": "Число хеджирующих запросов к запасной модели",
+    "llm_fallbacks_total": "Число переключений на следующую модель после ошибки",
+    "llm_responses_total": "Число ответов по моделям, ответившим первыми",
+    "model_load_seconds": "Время загрузки модели и ретривера",
+    "embedding_batch_seconds": "Время расчёта одного микро-батча на сервере эмбеддингов",
+    "download_tier_seconds": "Время каждой ступени поиска PDF",
+    "ingest_stage_seconds": "Время стадий загрузки статьи в базу",
+    "celery_queue_wait_seconds": "Время ожидания задачи в очереди Celery",
+    "celery_task_runtime_seconds": "Время выполнения задачи Celery",
+    "celery_tasks_total": "Число выполненных задач Celery по статусу",
+    "errors_total": "Число ошибок по этапам",
+}
+
+_client = None
+_client_lock = threading.Lock()
+
+_pending_histograms: dict[str, float] = {}
+_pending_counters: dict[str, float] = {}
+_pending_lock = threading.Lock()
+_flusher: threading.Thread | None = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import redis
+                _client = redis.Redis.from_url(
+                    REDIS_URL,
+                    socket_connect_timeout=METRICS_REDIS_TIMEOUT,
+                    socket_timeout=METRICS_REDIS_TIMEOUT
+                )
+    return _client
+
+
+def _labels(labels: dict) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+def flush() -> None:
+    global _pending_histograms, _pending_counters
+    with _pending_lock:
+        histograms, _pending_histograms = _pending_histograms, {}
+        counters, _pending_counters = _pending_counters, {}
+    if not histograms and not counters:
+        return
+
+    try:
+        pipe = _redis().pipeline(transaction=False)
+        for field, value in histograms.items():
+            if field.endswith("|sum"):
+                pipe.hincrbyfloat(HISTOGRAMS_KEY, field, value)
+            else:
+                pipe.hincrby(HISTOGRAMS_KEY, field, int(value))
+        for field, value in counters.items():
+            pipe.hincrbyfloat(COUNTERS_KEY, field, value)
+        pipe.execute()
+    except Exception as e:
+        print(f"Не удалось записать метрики: {e}")
+        # Набор полей ограничен набором меток, поэтому несброшенное можно вернуть в буфер
+        with _pending_lock:
+            for field, value in histograms.items():
+                _pending_histograms[field] = _pending_histograms.get(field, 0) + value
+            for field, value in counters.items():
+                _pending_counters[field] = _pending_counters.get(field, 0) + value
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def _ensure_flusher() -> None:
+    global _flusher
+    if _flusher is None:
+        with _pending_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+                _flusher.start()
+
+
+def _reset_after_fork() -> None:
+    # Буфер и поток родителя в дочернем процессе не нужны: иначе наблюдения посчитаются дважды
+    global _client, _flusher, _pending_histograms, _pending_counters, _client_lock, _pending_lock
+    _client = None
+    _flusher = None
+    _pending_histograms = {}
+    _pending_counters = {}
+    _client_lock = threading.Lock()
+    _pending_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(flush)
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    if not METRICS_ENABLED:
+        return
+    prefix = f"{name}|{_labels(labels)}|"
+    with _pending_lock:
+        for bound in BUCKETS:
+            if seconds <= bound:
+                field = f"{prefix}{bound}"
+                _pending_histograms[field] = _pending_histograms.get(field, 0) + 1
+        _pending_histograms[f"{prefix}+Inf"] = _pending_histograms.get(f"{prefix}+Inf", 0) + 1
+        _pending_histograms[f"{prefix}sum"] = _pending_histograms.get(f"{prefix}sum", 0.0) + seconds
+    _ensure_flusher()
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    if not METRICS_ENABLED:
+        return
+    field = f"{name}|{_labels(labels)}"
+    with _pending_lock:
+        _pending_counters[field] = _pending_counters.get(field, 0) + value
+    _ensure_flusher()
+
+
+@contextmanager
+def span(name: str, **labels):
+    """Отдаёт словарь меток: метку, известную только по итогу (например, модель), можно дописать внутри."""
+    started = time.perf_counter()
+    try:
+        yield labels
+    except Exception:
+        inc("errors_total", metric=name, **labels)
+        raise
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def timed(name: str, **labels):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _with_le(label_str: str, le: str) -> str:
+    le_label = f'le="{le}"'
+    return f"{label_str},{le_label}" if label_str else le_label
+
+
+def render() -> str:
+    flush()
+    client = _redis()
+    histograms = {_decode(k): float(_decode(v)) for k, v in client.hgetall(HISTOGRAMS_KEY).items()}
+    counters = {_decode(k): float(_decode(v)) for k, v in client.hgetall(COUNTERS_KEY).items()}
+
+    series: dict[str, dict[str, dict[str, float]]] = {}
+    for field, value in histograms.items():
+        name, label_str, suffix = field.split("|")
+        series.setdefault(name, {}).setdefault(label_str, {})[suffix] = value
+
+    lines = []
+    for name in sorted(series):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for label_str, values in sorted(series[name].items()):
+            for bound in BUCKETS:
+                lines.append(f"{name}_bucket{{{_with_le(label_str, str(bound))}}} {int(values.get(str(bound), 0))}")
+            total = int(values.get("+Inf", 0))
+            lines.append(f"{name}_bucket{{{_with_le(label_str, '+Inf')}}} {total}")
+            lines.append(f"{name}_sum{{{label_str}}} {values.get('sum', 0.0)}")
+            lines.append(f"{name}_count{{{label_str}}} {total}")
+
+    counter_series: dict[str, list[tuple[str, float]]] = {}
+    for field, value in counters.items():
+        name, label_str = field.split("|")
+        counter_series.setdefault(name, []).append((label_str, value))
+
+    for name in sorted(counter_series):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for label_str, value in sorted(counter_series[name]):
+            lines.append(f"{name}{{{label_str}}} {value}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,47 @@
+import json
+import os
+from urllib.parse import urlsplit, urlunsplit
+
+from source.services.celery_app import get_redis
+
+
+PDF_URL_CACHE_TTL = int(os.getenv("PDF_URL_CACHE_TTL", str(30 * 86400)))
+
+CACHE_KEY = "pdf_url:{url}"
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+
+def get_cached(url: str) -> dict | None:
+    try:
+        value = get_redis().get(CACHE_KEY.format(url=normalize_url(url)))
+    except Exception as e:
+        print(f"Кэш ссылок на PDF недоступен: {e}")
+        return None
+    return json.loads(value) if value else None
+
+
+def remember(urls, resolved: dict) -> None:
+    value = json.dumps({
+        "pdf_url": resolved["pdf_url"],
+        "referer": resolved.get("referer"),
+        "tier": resolved.get("tier"),
+    })
+    try:
+        client = get_redis()
+        for url in set(urls):
+            if url:
+                client.set(CACHE_KEY.format(url=normalize_url(url)), value, ex=PDF_URL_CACHE_TTL)
+    except Exception as e:
+        print(f"Не удалось сохранить ссылку на PDF в кэш: {e}")
+
+
+def forget(url: str) -> None:
+    try:
+        get_redis().delete(CACHE_KEY.format(url=normalize_url(url)))
+    except Exception as e:
+        print(f"Не удалось удалить ссылку на PDF из кэша: {e}")
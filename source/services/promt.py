@@ -1,20 +1,22 @@
-from db.db_connection import DbConnection
+from langchain_core.documents import Document
 
+from db.retriever import SEARCH_KWARGS, get_retriever
+from source.services.context_packer import count_tokens, pack_context
+from source.services.metrics import timed
 
-def get_prompt(user_query: str) -> str:
-    conn = DbConnection()
-    documents = conn.search(user_query, neighbor_window=2)
-
-    context_parts = []
 
-    if documents:
-        for doc in documents:
-            content = doc.page_content.strip()
+@timed("prompt_build_seconds", stage="get_prompt")
+def get_prompt(user_query: str) -> str:
+    conn = get_retriever()
+    documents = conn.search(user_query, **SEARCH_KWARGS)
+    return build_prompt(user_query, documents)
 
-            context_parts.append(content)
 
-        full_context = "\n\n".join(context_parts)
+@timed("prompt_build_seconds", stage="build_prompt")
+def build_prompt(user_query: str, documents: list[Document]) -> str:
+    full_context = pack_context(documents) if documents else ""
 
+    if full_context:
         final_prompt = f"""
 Твоя роль: Опытный научный исследователь-аналитик.
 Твоя задача: Сформулировать обоснованную научную гипотезу по запросу пользователя, основываясь на предоставленном КОНТЕКСТЕ.
@@ -47,6 +49,7 @@ def get_prompt(user_query: str) -> str:
 3. Укажи, что ответ дан без опоры на предоставленные документы.
 """
 
+    print(f"Размер промпта: {count_tokens(final_prompt)} токенов")
     return final_prompt
 
 
@@ -0,0 +1,217 @@
+import asyncio
+import os
+import threading
+import time
+
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Лимиты OpenRouter для модели; 0 отключает соответствующее ведро
+LLM_RATE_RPM = int(os.getenv("LLM_RATE_RPM", "20"))
+LLM_RATE_TPM = int(os.getenv("LLM_RATE_TPM", "0"))
+LLM_RATE_MAX_WAIT = float(os.getenv("LLM_RATE_MAX_WAIT", "300"))
+LLM_COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKENS", "512"))
+# Доля каждого ведра, которую фоновая полоса не трогает: она остаётся интерактивным запросам
+LLM_RATE_BULK_RESERVE = float(os.getenv("LLM_RATE_BULK_RESERVE", "0.25"))
+
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+
+BUCKET_KEY = "ratelimit:llm:{model}:{kind}"
+BLOCKED_KEY = "ratelimit:llm:{model}:blocked_until"
+
+# Два ведра (запросы и токены) списываются атомарно: либо оба, либо ни одного.
+# Время берётся из Redis, поэтому часы воркеров не должны совпадать.
+# Возвращает сколько секунд ждать до следующей попытки, "0" - разрешение получено.
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+
+local blocked = tonumber(redis.call('GET', KEYS[3]) or '0')
+if blocked > now then
+    return tostring(blocked - now)
+end
+
+local wait = 0
+local levels = {}
+for i = 1, 2 do
+    local capacity = tonumber(ARGV[(i - 1) * 2 + 1])
+    local need = tonumber(ARGV[(i - 1) * 2 + 2])
+    if capacity > 0 then
+        local target = math.min(capacity, need + tonumber(ARGV[5]) * capacity)
+        local rate = capacity / 60
+        local state = redis.call('HMGET', KEYS[i], 'level', 'ts')
+        local level = tonumber(state[1]) or capacity
+        local ts = tonumber(state[2]) or now
+        level = math.min(capacity, level + math.max(0, now - ts) * rate)
+        if level < target then
+            wait = math.max(wait, (target - level) / rate)
+        end
+        levels[i] = level
+    end
+end
+
+if wait > 0 then
+    return tostring(wait)
+end
+
+for i = 1, 2 do
+    if levels[i] ~= nil then
+        local need = tonumber(ARGV[(i - 1) * 2 + 2])
+        redis.call('HSET', KEYS[i], 'level', levels[i] - need, 'ts', now)
+        redis.call('EXPIRE', KEYS[i], 3600)
+    end
+end
+return '0'
+"""
+
+BLOCK_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local seconds = tonumber(ARGV[1])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if now + seconds > current then
+    redis.call('SET', KEYS[1], tostring(now + seconds), 'EX', math.ceil(seconds) + 1)
+end
+return 1
+"""
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class TokenBucketLimiter:
+    """Общий для кластера лимит запросов и токенов в минуту к одной модели."""
+
+    def __init__(
+            self,
+            model: str,
+            requests_per_minute: int = LLM_RATE_RPM,
+            tokens_per_minute: int = LLM_RATE_TPM,
+            max_wait: float = LLM_RATE_MAX_WAIT
+    ) -> None:
+        self.model = model
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_wait = max_wait
+        self.keys = [
+            BUCKET_KEY.format(model=model, kind="requests"),
+            BUCKET_KEY.format(model=model, kind="tokens"),
+            BLOCKED_KEY.format(model=model),
+        ]
+
+        self._client = None
+        self._async_client = None
+        self._scripts = None
+        self._async_scripts = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests_per_minute > 0 or self.tokens_per_minute > 0
+
+    def _args(self, tokens: int, lane: str) -> list:
+        # Запрос больше ёмкости ведра не дождётся никогда, поэтому ограничиваем его ёмкостью
+        tokens = min(tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+        reserve = LLM_RATE_BULK_RESERVE if lane == LANE_BULK else 0
+        return [self.requests_per_minute, 1, self.tokens_per_minute, tokens, reserve]
+
+    def _get_scripts(self):
+        if self._scripts is None:
+            with self._lock:
+                if self._scripts is None:
+                    import redis
+                    self._client = redis.Redis.from_url(REDIS_URL)
+                    self._scripts = (
+                        self._client.register_script(TOKEN_BUCKET_SCRIPT),
+                        self._client.register_script(BLOCK_SCRIPT),
+                    )
+        return self._scripts
+
+    def _get_async_scripts(self):
+        if self._async_scripts is None:
+            import redis.asyncio as aioredis
+            self._async_client = aioredis.from_url(REDIS_URL)
+            self._async_scripts = (
+                self._async_client.register_script(TOKEN_BUCKET_SCRIPT),
+                self._async_client.register_script(BLOCK_SCRIPT),
+            )
+        return self._async_scripts
+
+    def acquire(self, tokens: int = 0, lane: str = LANE_INTERACTIVE) -> float:
+        """Блокирует до получения разрешения, возвращает время ожидания."""
+        if not self.enabled:
+            return 0.0
+
+        started = time.monotonic()
+        while True:
+            try:
+                wait = float(self._get_scripts()[0](keys=self.keys, args=self._args(tokens, lane)))
+            except Exception as e:
+                print(f"Лимитер запросов к LLM недоступен, продолжаю без него: {e}")
+                return 0.0
+            waited = time.monotonic() - started
+            if wait <= 0:
+                return waited
+            if waited + wait > self.max_wait:
+                raise RateLimitTimeout(f"Лимит запросов к {self.model} не освободился за {self.max_wait:.0f} с")
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0, lane: str = LANE_INTERACTIVE) -> float:
+        if not self.enabled:
+            return 0.0
+
+        started = time.monotonic()
+        while True:
+            try:
+                wait = float(await self._get_async_scripts()[0](keys=self.keys, args=self._args(tokens, lane)))
+            except Exception as e:
+                print(f"Лимитер запросов к LLM недоступен, продолжаю без него: {e}")
+                return 0.0
+            waited = time.monotonic() - started
+            if wait <= 0:
+                return waited
+            if waited + wait > self.max_wait:
+                raise RateLimitTimeout(f"Лимит запросов к {self.model} не освободился за {self.max_wait:.0f} с")
+            await asyncio.sleep(wait)
+
+    def block(self, seconds: float) -> None:
+        """После 429 от провайдера придерживает всех клиентов на Retry-After."""
+        if not self.enabled or seconds <= 0:
+            return
+        try:
+            self._get_scripts()[1](keys=self.keys[2:], args=[seconds])
+        except Exception as e:
+            print(f"Не удалось приостановить лимитер: {e}")
+
+    async def block_async(self, seconds: float) -> None:
+        if not self.enabled or seconds <= 0:
+            return
+        try:
+            await self._get_async_scripts()[1](keys=self.keys[2:], args=[seconds])
+        except Exception as e:
+            print(f"Не удалось приостановить лимитер: {e}")
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_scripts = None
+
+
+_limiters: dict[str, TokenBucketLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> TokenBucketLimiter:
+    limiter = _limiters.get(model)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(model, TokenBucketLimiter(model))
+    return limiter
+
+
+async def close_rate_limiters() -> None:
+    for limiter in list(_limiters.values()):
+        await limiter.aclose()
@@ -0,0 +1,51 @@
+import json
+import time
+
+import redis.asyncio as aioredis
+from celery import states
+from celery.result import AsyncResult
+from fastapi.concurrency import run_in_threadpool
+
+from source.services.celery_app import celery_app, REDIS_URL
+
+
+_client: aioredis.Redis | None = None
+
+
+def get_async_redis() -> aioredis.Redis:
+    global _client
+    if _client is None:
+        _client = aioredis.from_url(REDIS_URL)
+    return _client
+
+
+async def close_async_redis() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _state(task_id: str) -> str:
+    return AsyncResult(task_id, app=celery_app).state
+
+
+async def wait_for_task(task_id: str, timeout: float, ready_states=states.READY_STATES) -> str:
+    channel = celery_app.backend.get_key_for_task(task_id)
+    pubsub = get_async_redis().pubsub()
+    try:
+        await pubsub.subscribe(channel)
+
+        state = await run_in_threadpool(_state, task_id)
+        deadline = time.monotonic() + timeout
+        while state not in ready_states:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=min(remaining, 1.0))
+            if message is None:
+                continue
+            state = json.loads(message["data"]).get("status", state)
+        return state
+    finally:
+        await pubsub.aclose()
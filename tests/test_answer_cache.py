@@ -0,0 +1,63 @@
+import time
+
+from source.services import answer_cache as answer_cache_module
+from source.services.answer_cache import AnswerCache
+
+
+VECTOR = [1.0, 0.0, 0.0]
+
+
+def _no_invalidation(monkeypatch):
+    monkeypatch.setattr(answer_cache_module, "_invalidated_after", lambda sources, created_at: False)
+
+
+def test_hit_for_similar_query_and_same_context(monkeypatch):
+    _no_invalidation(monkeypatch)
+    cache = AnswerCache(threshold=0.9)
+    cache.put(VECTOR, "ctx", "answer", {"a.pdf"})
+
+    assert cache.get([0.99, 0.05, 0.0], "ctx") == "answer"
+    assert cache.get(VECTOR, "other-ctx") is None
+    assert cache.get([0.0, 1.0, 0.0], "ctx") is None
+
+
+def test_expired_entry_is_dropped(monkeypatch):
+    _no_invalidation(monkeypatch)
+    cache = AnswerCache(ttl=60)
+    cache.put(VECTOR, "ctx", "answer", {"a.pdf"})
+
+    now = time.time()
+    monkeypatch.setattr(answer_cache_module.time, "time", lambda: now + 61)
+
+    assert cache.get(VECTOR, "ctx") is None
+    assert not cache._entries
+    assert "ctx" not in cache._by_fingerprint
+
+
+def test_invalidated_source_drops_entry(monkeypatch):
+    invalidated = {"a.pdf"}
+    monkeypatch.setattr(
+        answer_cache_module, "_invalidated_after", lambda sources, created_at: bool(sources & invalidated)
+    )
+    cache = AnswerCache()
+    cache.put(VECTOR, "ctx", "stale", {"a.pdf"})
+    cache.put([0.0, 1.0, 0.0], "ctx", "fresh", {"b.pdf"})
+
+    assert cache.get(VECTOR, "ctx") is None
+    assert cache.get([0.0, 1.0, 0.0], "ctx") == "fresh"
+    assert len(cache._entries) == 1
+
+
+def test_concurrent_gets_removing_same_entry(monkeypatch):
+    monkeypatch.setattr(answer_cache_module, "_invalidated_after", lambda sources, created_at: True)
+    cache = AnswerCache()
+    cache.put(VECTOR, "ctx", "stale", {"a.pdf"})
+    cache.put([0.0, 1.0, 0.0], "ctx", "other", {"a.pdf"})
+    best_key = next(iter(cache._entries))
+
+    # Оба get выбрали одну запись и удаляют её после проверки инвалидации
+    cache._remove(best_key)
+    cache._remove(best_key)
+
+    assert best_key not in cache._entries
+    assert cache._by_fingerprint["ctx"] == [best_key[1] + 1]
@@ -0,0 +1,27 @@
+from langchain_core.documents import Document
+
+from db.populate_db import split_pages
+from source.services.context_packer import merge_passages
+
+
+def test_overlapping_splitter_chunks_are_merged():
+    words = [f"word{i}" for i in range(400)]
+    page = Document(page_content=" ".join(words), metadata={"source": "paper.pdf", "page": 0})
+
+    chunks = split_pages([page])
+    assert len(chunks) >= 2
+    assert [chunk.metadata["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+
+    retrieved = chunks[:2]
+    for rank, chunk in enumerate(retrieved):
+        chunk.metadata["retrieval_rank"] = rank
+
+    passages = merge_passages(list(reversed(retrieved)))
+
+    assert len(passages) == 1
+    merged = passages[0].text
+    assert merged.startswith(retrieved[0].page_content)
+    assert merged.endswith(retrieved[1].page_content)
+    # Перекрытие сплиттера попадает в склейку один раз
+    assert len(merged) < len(retrieved[0].page_content) + len(retrieved[1].page_content)
+    assert merged.split().count(retrieved[1].page_content.split()[0]) == 1
@@ -0,0 +1,26 @@
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from db.db_connection import DbConnection
+from db.lexical_index import LexicalIndex
+
+
+def test_store_built_before_lexical_index_gets_lexical_hits(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=8)
+    # Хранилище без файла BM25 - как собранное до появления лексического индекса
+    store = Chroma(embedding_function=embeddings, persist_directory=str(tmp_path))
+    store.add_texts(
+        ["photosynthesis converts light into chemical energy", "mitochondria produce ATP"],
+        metadatas=[{"source": "bio.pdf", "chunk_index": 0}, {"source": "bio.pdf", "chunk_index": 1}],
+        ids=["chunk-0", "chunk-1"]
+    )
+    assert LexicalIndex(str(tmp_path)).count() == 0
+
+    connection = DbConnection(str(tmp_path), embeddings=embeddings)
+
+    assert connection.lexical.count() == 2
+    assert connection.lexical.search("photosynthesis") == ["chunk-0"]
+    assert connection.lexical.missing(["chunk-0", "chunk-1", "chunk-2"]) == ["chunk-2"]
+
+    # Повторное открытие ничего не дублирует
+    assert DbConnection(str(tmp_path), embeddings=embeddings).lexical.count() == 2
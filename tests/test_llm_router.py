@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+from source.services import llm_router as llm_router_module
+from source.services.llm_client import LLMError
+from source.services.llm_router import LLMRouter
+
+
+class FakeStats:
+    def __init__(self) -> None:
+        self.records = []
+        self.bumps = []
+
+    def snapshot(self, model: str) -> dict:
+        return {"samples": 0, "ttft_p50": None, "ttft_p95": None, "error_rate": 0.0}
+
+    def record(self, model: str, ok: bool, ttft: float | None = None) -> None:
+        self.records.append((model, ok))
+
+    def bump(self, model: str, name: str) -> None:
+        self.bumps.append((model, name))
+
+
+class FakeClient:
+    """Транспорт по сценарию модели: задержка до первого токена, токены или ошибка."""
+
+    def __init__(self, scripts: dict) -> None:
+        self.scripts = scripts
+        self.controls = {}
+
+    def stream(self, prompt, model=None, lane=None, control=None):
+        self.controls[model] = control
+        control.sent()
+        script = self.scripts[model]
+        # Отмена будит ожидание так же, как shutdown сокета будит чтение
+        if control.cancelled.wait(script.get("delay", 0)):
+            return
+        if "error" in script:
+            raise script["error"]
+        yield from script["tokens"]
+
+
+def _router(monkeypatch, models: list[str], scripts: dict, budget: float = 5.0):
+    client = FakeClient(scripts)
+    monkeypatch.setattr(llm_router_module, "get_llm_client", lambda: client)
+    monkeypatch.setattr(llm_router_module, "observe", lambda *args, **kwargs: None)
+    monkeypatch.setattr(llm_router_module, "inc", lambda *args, **kwargs: None)
+    monkeypatch.setattr(llm_router_module, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(llm_router_module, "LLM_HEDGE_DEFAULT_BUDGET", budget)
+    stats = FakeStats()
+    return LLMRouter(models, stats), client, stats
+
+
+def _wait_for(predicate, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_hedge_wins_and_slow_primary_is_cancelled(monkeypatch):
+    router, client, stats = _router(
+        monkeypatch,
+        ["slow", "fast"],
+        {"slow": {"delay": 10, "tokens": ["late"]}, "fast": {"tokens": ["hy", "pothesis"]}},
+        budget=0.05
+    )
+
+    assert router.complete("prompt") == ("hypothesis", "fast")
+
+    assert ("slow", "hedged") in stats.bumps
+    assert ("fast", "wins") in stats.bumps
+    assert client.controls["slow"].cancelled.is_set()
+    # Проигравший поток завершается сам и отмечает отмену, а не ошибку
+    assert _wait_for(lambda: ("slow", "cancelled") in stats.bumps)
+    assert ("slow", False) not in stats.records
+
+
+def test_falls_back_when_primary_fails(monkeypatch):
+    router, client, stats = _router(
+        monkeypatch,
+        ["broken", "backup"],
+        {"broken": {"error": LLMError("http_error", "boom", status_code=500)}, "backup": {"tokens": ["ok"]}}
+    )
+
+    assert router.complete("prompt") == ("ok", "backup")
+
+    assert ("broken", False) in stats.records
+    assert ("backup", True) in stats.records
+    assert ("broken", "hedged") not in stats.bumps
+
+
+def test_raises_last_error_when_every_model_fails(monkeypatch):
+    router, client, stats = _router(
+        monkeypatch,
+        ["first", "second"],
+        {
+            "first": {"error": LLMError("http_error", "first", status_code=500)},
+            "second": {"error": LLMError("http_error", "second", status_code=503)},
+        }
+    )
+
+    with pytest.raises(LLMError) as err:
+        router.complete("prompt")
+    assert err.value.status_code == 503